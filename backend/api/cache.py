@@ -0,0 +1,70 @@
+import threading
+
+from django.core.cache import caches
+from foodgram.constants import RECIPE_CACHE_TIMEOUT
+
+RECIPE_CACHE_ALIAS = 'recipes'
+
+
+class RecipeRepresentationCache:
+    """Кэш не зависящей от пользователя части представления рецептов.
+        Ключ содержит дату изменения рецепта, которую сигналы обновляют
+        при изменении рецепта, его ингредиентов, тегов и автора, поэтому
+        устаревшие записи не читаются и вытесняются бэкендом кэша"""
+
+    prefix = 'recipe-representation'
+
+    def __init__(self, alias):
+        self.alias = alias
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    @property
+    def cache(self):
+
+        return caches[self.alias]
+
+    def key(self, recipe):
+
+        return f'{self.prefix}:{recipe.pk}:{recipe.modified.isoformat()}'
+
+    def get_many(self, recipes, build):
+        """Словарь {id рецепта: представление}. Недостающие
+            представления строит build одним вызовом для всех промахов"""
+
+        keys = {self.key(recipe): recipe for recipe in recipes}
+        found = self.cache.get_many(keys)
+        misses = [
+            recipe for key, recipe in keys.items() if key not in found
+        ]
+        with self._lock:
+            self._hits += len(found)
+            self._misses += len(misses)
+
+        result = {keys[key].pk: data for key, data in found.items()}
+        if misses:
+            built = build(misses)
+            self.cache.set_many(
+                {self.key(recipe): built[recipe.pk] for recipe in misses},
+                RECIPE_CACHE_TIMEOUT
+            )
+            result.update(built)
+
+        return result
+
+    def stats(self):
+        """Попадания и промахи кэша в текущем процессе"""
+
+        with self._lock:
+            hits, misses = self._hits, self._misses
+        total = hits + misses
+
+        return {
+            'hits': hits,
+            'misses': misses,
+            'hit_ratio': round(hits / total, 4) if total else None,
+        }
+
+
+recipe_representations = RecipeRepresentationCache(RECIPE_CACHE_ALIAS)
@@ -0,0 +1,160 @@
+import csv
+import json
+
+SHOPPING_LIST_TITLE = 'Список покупок'
+
+PDF_PAGE_WIDTH = 595
+PDF_PAGE_HEIGHT = 842
+PDF_MARGIN = 50
+PDF_FONT_SIZE = 11
+PDF_LINE_HEIGHT = 16
+PDF_LINES_PER_PAGE = (PDF_PAGE_HEIGHT - 2 * PDF_MARGIN) // PDF_LINE_HEIGHT
+
+
+class Echo:
+    """Буфер для csv.writer, который возвращает записанную строку"""
+
+    def write(self, value):
+        return value
+
+
+def render_txt(ingredients):
+
+    yield f'{SHOPPING_LIST_TITLE}: \n\n'
+    for name, amount, unit in ingredients:
+        yield f'{name} - {amount} {unit}.\n'
+
+
+def render_csv(ingredients):
+
+    writer = csv.writer(Echo())
+    yield '\ufeff' + writer.writerow(('name', 'amount', 'measurement_unit'))
+    for name, amount, unit in ingredients:
+        yield writer.writerow((name, amount, unit))
+
+
+def render_json(ingredients):
+
+    separator = '['
+    for name, amount, unit in ingredients:
+        yield separator + json.dumps(
+            {'name': name, 'amount': amount, 'measurement_unit': unit},
+            ensure_ascii=False
+        )
+        separator = ','
+    yield '[]' if separator == '[' else ']'
+
+
+def pdf_cyrillic_differences():
+    """Имена глифов Adobe для кириллицы в кодировке cp1251"""
+
+    differences = [168, '/afii10023', 184, '/afii10071', 192]
+    for index in range(32):
+        glyph = 10017 + index + (index >= 6)
+        differences.append(f'/afii{glyph}')
+    for index in range(32):
+        glyph = 10065 + index + (index >= 6)
+        differences.append(f'/afii{glyph}')
+
+    return ' '.join(str(item) for item in differences)
+
+
+def pdf_text(value):
+
+    encoded = value.encode('cp1251', errors='replace')
+
+    return (
+        encoded
+        .replace(b'\\', b'\\\\')
+        .replace(b'(', b'\\(')
+        .replace(b')', b'\\)')
+    )
+
+
+def render_pdf(ingredients):
+    """PDF формируется постранично: в памяти только текущая страница,
+        таблица смещений объектов пишется в конце файла"""
+
+    offsets = {}
+    position = 0
+    page_ids = []
+    next_id = 4
+
+    def pdf_object(object_id, body):
+        nonlocal position
+        offsets[object_id] = position
+        chunk = b'%d 0 obj\n' % object_id + body + b'\nendobj\n'
+        position += len(chunk)
+
+        return chunk
+
+    def pdf_page(lines):
+        nonlocal next_id
+        content = b''.join(
+            [
+                b'BT /F1 %d Tf %d TL %d %d Td\n' % (
+                    PDF_FONT_SIZE, PDF_LINE_HEIGHT,
+                    PDF_MARGIN, PDF_PAGE_HEIGHT - PDF_MARGIN
+                ),
+            ]
+            + [b'(' + pdf_text(line) + b') Tj T*\n' for line in lines]
+            + [b'ET']
+        )
+        content_id, page_id = next_id, next_id + 1
+        next_id += 2
+        page_ids.append(page_id)
+
+        return pdf_object(
+            content_id,
+            b'<< /Length %d >>\nstream\n' % len(content)
+            + content + b'\nendstream'
+        ) + pdf_object(
+            page_id,
+            b'<< /Type /Page /Parent 2 0 R /Contents %d 0 R >>' % content_id
+        )
+
+    header = b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n'
+    position = len(header)
+    yield header + pdf_object(
+        3,
+        b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica '
+        b'/Encoding << /Type /Encoding /BaseEncoding /WinAnsiEncoding '
+        b'/Differences [' + pdf_cyrillic_differences().encode() + b'] >> >>'
+    )
+
+    lines = [f'{SHOPPING_LIST_TITLE}:', '']
+    for name, amount, unit in ingredients:
+        lines.append(f'{name} - {amount} {unit}.')
+        if len(lines) == PDF_LINES_PER_PAGE:
+            yield pdf_page(lines)
+            lines = []
+    if lines or not page_ids:
+        yield pdf_page(lines)
+
+    kids = b' '.join(b'%d 0 R' % page_id for page_id in page_ids)
+    tail = pdf_object(
+        2,
+        b'<< /Type /Pages /Kids [' + kids + b'] /Count %d '
+        b'/Resources << /Font << /F1 3 0 R >> >> '
+        b'/MediaBox [0 0 %d %d] >>' % (
+            len(page_ids), PDF_PAGE_WIDTH, PDF_PAGE_HEIGHT
+        )
+    ) + pdf_object(1, b'<< /Type /Catalog /Pages 2 0 R >>')
+
+    xref = [b'xref\n0 %d\n' % next_id, b'0000000000 65535 f \n']
+    xref.extend(
+        b'%010d 00000 n \n' % offsets[object_id]
+        for object_id in range(1, next_id)
+    )
+    yield tail + b''.join(xref) + (
+        b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n'
+        % (next_id, position)
+    )
+
+
+SHOPPING_LIST_FORMATS = {
+    'txt': (render_txt, 'text/plain; charset=utf-8'),
+    'csv': (render_csv, 'text/csv; charset=utf-8'),
+    'json': (render_json, 'application/json'),
+    'pdf': (render_pdf, 'application/pdf'),
+}
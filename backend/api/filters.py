@@ -18,7 +18,8 @@ class IngredientFilter(FilterSet):
 
 class RecipesFilter(FilterSet):
     """Фильтрация по:
-        тегам, в избранном, в списке покупок"""
+        тегам, в избранном, в списке покупок,
+        полнотекстовый поиск по названию и описанию"""
 
     tags = filters.ModelMultipleChoiceFilter(
         field_name='tags__slug',
@@ -31,6 +32,9 @@ class RecipesFilter(FilterSet):
     is_in_shopping_cart = filters.BooleanFilter(
         method='get_is_in_shopping_cart',
     )
+    search = filters.CharFilter(
+        method='get_search',
+    )
 
     class Meta:
         model = Recipes
@@ -54,3 +58,7 @@ class RecipesFilter(FilterSet):
             return queryset.filter(shopping_list__user=self.request.user)
 
         return queryset
+
+    def get_search(self, queryset, name, value):
+
+        return queryset.search(value)
@@ -0,0 +1,143 @@
+import atexit
+import logging
+import queue
+import threading
+import time
+
+from django.apps import apps
+from django.conf import settings
+from django.db import close_old_connections
+
+logger = logging.getLogger(__name__)
+
+
+class APILogWriter:
+    """Очередь записей журнала API: запрос только кладёт запись
+        в ограниченную очередь, фоновый поток пишет их пакетами через
+        bulk_create. При заполненной очереди записи отбрасываются
+        и учитываются в счётчиках, запрос не ждёт. Модель журнала
+        drf_api_logger создаёт только при API_LOG['ENABLED'], поэтому
+        она берётся из реестра приложений при записи"""
+
+    thread_name = 'api-log-writer'
+
+    def __init__(self, queue_size, batch_size, flush_interval):
+        self.queue = queue.Queue(queue_size)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._thread = None
+        self._counters = dict.fromkeys(
+            ('queued', 'written', 'dropped', 'sampled_out', 'failed'), 0
+        )
+        self._reported_drops = 0
+
+    def count(self, name, value=1):
+
+        with self._lock:
+            self._counters[name] += value
+
+    def put(self, entry):
+
+        self.start()
+        try:
+            self.queue.put_nowait(entry)
+        except queue.Full:
+            self.count('dropped')
+
+            return
+
+        self.count('queued')
+
+    def start(self):
+        """Поток запускается при первой записи, в том числе заново
+            в каждом процессе после fork"""
+
+        if self._thread is not None and self._thread.is_alive():
+
+            return
+
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self.run, name=self.thread_name, daemon=True
+                )
+                self._thread.start()
+
+    def run(self):
+
+        while True:
+            self.write(self.next_batch())
+
+    def next_batch(self):
+        """До batch_size записей, но не дольше flush_interval
+            после первой"""
+
+        batch = [self.queue.get()]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+
+        return batch
+
+    def write(self, batch):
+
+        model = apps.get_model('drf_api_logger', 'APILogsModel')
+        try:
+            model.objects.bulk_create([model(**entry) for entry in batch])
+            self.count('written', len(batch))
+        except Exception:
+            self.count('failed', len(batch))
+            logger.exception('Не удалось записать журнал API')
+        finally:
+            close_old_connections()
+        self.report_drops()
+
+    def report_drops(self):
+
+        with self._lock:
+            dropped = self._counters['dropped'] - self._reported_drops
+            self._reported_drops = self._counters['dropped']
+        if dropped:
+            logger.warning(
+                'Очередь журнала API переполнена: отброшено записей %s',
+                dropped
+            )
+
+    def flush(self):
+        """Записывает оставшееся в очереди в текущем потоке"""
+
+        batch = []
+        while True:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+            if len(batch) == self.batch_size:
+                self.write(batch)
+                batch = []
+        if batch:
+            self.write(batch)
+
+    def stats(self):
+        """Счётчики журнала и длина очереди в текущем процессе"""
+
+        with self._lock:
+            stats = dict(self._counters)
+        stats['pending'] = self.queue.qsize()
+
+        return stats
+
+
+api_log_writer = APILogWriter(
+    settings.API_LOG['QUEUE_SIZE'],
+    settings.API_LOG['BATCH_SIZE'],
+    settings.API_LOG['FLUSH_INTERVAL'],
+)
+atexit.register(api_log_writer.flush)
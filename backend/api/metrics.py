@@ -0,0 +1,223 @@
+import contextvars
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from contextlib import contextmanager
+
+from .cache import recipe_representations
+from .logs import api_log_writer
+
+DURATION_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10
+)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+SIZE_BUCKETS = tuple(256 * 4 ** power for power in range(8))
+UNMATCHED_ROUTE = 'unmatched'
+
+current_timings = contextvars.ContextVar('current_timings', default=None)
+
+
+class RequestTimings:
+    """Время запроса по частям: SQL через execute_wrapper,
+        сериализация через span('serializer')"""
+
+    def __init__(self):
+        self.durations = defaultdict(float)
+        self.queries = 0
+        self._active = set()
+
+    def execute(self, execute, sql, params, many, context):
+
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.durations['db'] += time.perf_counter() - started
+            self.queries += 1
+
+    @contextmanager
+    def span(self, name):
+        """Вложенные участки с тем же именем не считаются дважды"""
+
+        if name in self._active:
+            yield
+
+            return
+
+        self._active.add(name)
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.durations[name] += time.perf_counter() - started
+            self._active.discard(name)
+
+    def server_timing(self):
+
+        return ', '.join((
+            'db;dur={:.1f};desc="{} queries"'.format(
+                self.durations['db'] * 1000, self.queries
+            ),
+            'serializer;dur={:.1f}'.format(
+                self.durations['serializer'] * 1000
+            ),
+            'view;dur={:.1f}'.format(self.durations['view'] * 1000),
+        ))
+
+
+@contextmanager
+def span(name):
+    """Участок текущего запроса; вне запроса ничего не измеряет"""
+
+    timings = current_timings.get()
+    if timings is None:
+        yield
+
+        return
+
+    with timings.span(name):
+        yield
+
+
+class Histogram:
+    """Гистограмма Prometheus с метками"""
+
+    def __init__(self, name, help_text, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self._series = {}
+
+    def observe(self, labels, value):
+
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [[0] * len(self.buckets), 0, 0]
+        index = bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            series[0][index] += 1
+        series[1] += value
+        series[2] += 1
+
+    def exposition(self, label_names):
+
+        yield f'# HELP {self.name} {self.help_text}'
+        yield f'# TYPE {self.name} histogram'
+        for labels, (counts, total, count) in sorted(self._series.items()):
+            base = format_labels(zip(label_names, labels))
+            cumulative = 0
+            for bound, bucket in zip(self.buckets, counts):
+                cumulative += bucket
+                yield '{}_bucket{{{}le="{}"}} {}'.format(
+                    self.name, base and base + ',', bound, cumulative
+                )
+            yield '{}_bucket{{{}le="+Inf"}} {}'.format(
+                self.name, base and base + ',', count
+            )
+            yield f'{self.name}_sum{{{base}}} {total}'
+            yield f'{self.name}_count{{{base}}} {count}'
+
+
+def format_labels(pairs):
+
+    return ','.join(
+        '{}="{}"'.format(
+            name,
+            str(value).replace('\\', '\\\\').replace('"', '\\"')
+        )
+        for name, value in pairs
+    )
+
+
+class RequestMetrics:
+    """Гистограммы запросов по маршруту и методу в текущем процессе:
+        каждый воркер gunicorn отдаёт свои значения"""
+
+    label_names = ('route', 'method')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.histograms = {
+            'view': Histogram(
+                'foodgram_request_duration_seconds',
+                'Время обработки запроса представлением',
+                DURATION_BUCKETS
+            ),
+            'db': Histogram(
+                'foodgram_request_db_seconds',
+                'Время SQL-запросов за запрос',
+                DURATION_BUCKETS
+            ),
+            'serializer': Histogram(
+                'foodgram_request_serializer_seconds',
+                'Время сериализации за запрос',
+                DURATION_BUCKETS
+            ),
+            'queries': Histogram(
+                'foodgram_request_queries',
+                'Число SQL-запросов за запрос',
+                QUERY_BUCKETS
+            ),
+            'size': Histogram(
+                'foodgram_response_size_bytes',
+                'Размер ответа',
+                SIZE_BUCKETS
+            ),
+        }
+
+    def observe(self, route, method, timings, size):
+
+        labels = (route, method)
+        values = {
+            'view': timings.durations['view'],
+            'db': timings.durations['db'],
+            'serializer': timings.durations['serializer'],
+            'queries': timings.queries,
+            'size': size,
+        }
+        with self._lock:
+            for name, value in values.items():
+                self.histograms[name].observe(labels, value)
+
+    def exposition(self):
+        """Текстовый формат Prometheus: гистограммы запросов,
+            счётчики кэша представлений и журнала API"""
+
+        lines = []
+        with self._lock:
+            for histogram in self.histograms.values():
+                lines.extend(histogram.exposition(self.label_names))
+
+        cache = recipe_representations.stats()
+        lines.extend((
+            '# HELP foodgram_recipe_cache_requests_total '
+            'Обращения к кэшу представлений рецептов',
+            '# TYPE foodgram_recipe_cache_requests_total counter',
+            'foodgram_recipe_cache_requests_total{{result="hit"}} {}'.format(
+                cache['hits']
+            ),
+            'foodgram_recipe_cache_requests_total{{result="miss"}} {}'.format(
+                cache['misses']
+            ),
+        ))
+        log = api_log_writer.stats()
+        pending = log.pop('pending')
+        lines.extend((
+            '# HELP foodgram_api_log_entries_total Записи журнала API',
+            '# TYPE foodgram_api_log_entries_total counter',
+        ))
+        lines.extend(
+            f'foodgram_api_log_entries_total{{state="{state}"}} {value}'
+            for state, value in log.items()
+        )
+        lines.extend((
+            '# HELP foodgram_api_log_pending Записи в очереди журнала API',
+            '# TYPE foodgram_api_log_pending gauge',
+            f'foodgram_api_log_pending {pending}',
+        ))
+
+        return '\n'.join(lines) + '\n'
+
+
+request_metrics = RequestMetrics()
@@ -0,0 +1,213 @@
+import json
+import random
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.utils import timezone
+from drf_api_logger.utils import get_client_ip, mask_sensitive_data
+
+from .logs import api_log_writer
+from .metrics import (UNMATCHED_ROUTE, RequestTimings, current_timings,
+                      request_metrics)
+
+JSON_CONTENT_TYPES = ('application/json', 'application/vnd.api+json')
+REDACTED = '***FILTERED***'
+REDACTED_HEADERS = ('HTTP_AUTHORIZATION', 'HTTP_COOKIE')
+REDACTED_KEYS = ('password', 'token', 'secret', 'access', 'refresh')
+
+
+def redacted(data, limit):
+    """Копия data без секретов (ключи с password, token и т. п.)
+        и с укороченными длинными строками, например картинками base64"""
+
+    if isinstance(data, dict):
+
+        return {
+            key: REDACTED if any(
+                secret in str(key).lower() for secret in REDACTED_KEYS
+            ) else redacted(value, limit)
+            for key, value in data.items()
+        }
+
+    if isinstance(data, list):
+
+        return [redacted(item, limit) for item in data]
+
+    if isinstance(data, str) and len(data) > limit:
+
+        return f'{data[:limit]}… ({len(data)} символов)'
+
+    return data
+
+
+def body_text(content, content_type, length, limits):
+    """Тело в виде JSON-текста. Большие и не-JSON тела заменяются
+        описанием, чтобы не разбирать и не хранить мегабайты"""
+
+    if not length:
+
+        return ''
+
+    content_type = content_type.split(';')[0].strip()
+    if (
+        content is None
+        or length > limits['BODY_LIMIT']
+        or not content_type.startswith(JSON_CONTENT_TYPES)
+    ):
+
+        return f'** {content_type or "без типа"}, {length} байт **'
+
+    try:
+        data = json.loads(content)
+    except ValueError:
+
+        return '** некорректный JSON **'
+
+    return json.dumps(
+        redacted(data, limits['VALUE_LIMIT']), indent=4, ensure_ascii=False
+    )
+
+
+class APILogMiddleware:
+    """Журнал запросов к API в drf_api_logs без записи в базу
+        в потоке запроса: записи уходят в очередь api_log_writer.
+        Успешные ответы записываются с вероятностью SAMPLE_RATES
+        по имени маршрута, ошибки — всегда. При API_LOG['ENABLED']
+        = False middleware отключается"""
+
+    def __init__(self, get_response):
+        if not settings.API_LOG['ENABLED']:
+
+            raise MiddlewareNotUsed
+
+        self.get_response = get_response
+        self.settings = settings.API_LOG
+
+    def __call__(self, request):
+
+        started = time.monotonic()
+        length = self.request_length(request)
+        request_body = None
+        if 0 < length <= self.settings['BODY_LIMIT']:
+            request_body = request.body
+        response = self.get_response(request)
+
+        match = request.resolver_match
+        if (
+            match is None
+            or match.namespace == 'admin'
+            or not self.sampled(match.url_name, response.status_code)
+        ):
+
+            return response
+
+        if getattr(response, 'streaming', False):
+            response_body = '** потоковый ответ **'
+        else:
+            response_body = body_text(
+                response.content,
+                response.get('Content-Type', ''),
+                len(response.content),
+                self.settings
+            )
+        api_log_writer.put(dict(
+            api=mask_sensitive_data(
+                request.build_absolute_uri(), mask_api_parameters=True
+            ),
+            headers=json.dumps(
+                self.headers(request), indent=4, ensure_ascii=False
+            ),
+            body=body_text(
+                request_body,
+                request.META.get('CONTENT_TYPE', ''),
+                length,
+                self.settings
+            ),
+            method=request.method,
+            client_ip_address=get_client_ip(request),
+            response=response_body,
+            status_code=response.status_code,
+            execution_time=round(time.monotonic() - started, 5),
+            added_on=timezone.now(),
+        ))
+
+        return response
+
+    @staticmethod
+    def request_length(request):
+        """Длина тела по CONTENT_LENGTH: тело читается до представления,
+            только если оно не больше BODY_LIMIT, поэтому большие
+            загрузки не копируются в память"""
+
+        try:
+            return int(request.META.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+
+            return 0
+
+    def sampled(self, url_name, status_code):
+
+        if status_code >= 400:
+
+            return True
+
+        rate = self.settings['SAMPLE_RATES'].get(
+            url_name, self.settings['SAMPLE_RATE']
+        )
+        if rate >= 1 or random.random() < rate:
+
+            return True
+
+        api_log_writer.count('sampled_out')
+
+        return False
+
+    @staticmethod
+    def headers(request):
+
+        return {
+            header[5:]: REDACTED if header in REDACTED_HEADERS else value
+            for header, value in request.META.items()
+            if header.startswith('HTTP_')
+        }
+
+
+class MetricsMiddleware:
+    """Число и время SQL-запросов, время сериализации и представления,
+        размер ответа: в заголовке Server-Timing и в гистограммах
+        request_metrics по имени маршрута. Стоит последним, чтобы
+        время представления не включало остальные middleware"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+
+        timings = RequestTimings()
+        token = current_timings.set(timings)
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(
+                        connection.execute_wrapper(timings.execute)
+                    )
+                with timings.span('view'):
+                    response = self.get_response(request)
+        finally:
+            current_timings.reset(token)
+
+        match = request.resolver_match
+        request_metrics.observe(
+            match.view_name if match else UNMATCHED_ROUTE,
+            request.method,
+            timings,
+            0 if getattr(response, 'streaming', False) else len(
+                response.content
+            )
+        )
+        response['Server-Timing'] = timings.server_timing()
+
+        return response
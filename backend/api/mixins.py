@@ -1,8 +1,91 @@
+import hashlib
+
+from django.utils.cache import (get_conditional_response, patch_cache_control,
+                                patch_vary_headers)
+from django.utils.http import http_date, quote_etag
 from django_filters.rest_framework import DjangoFilterBackend
+from foodgram.constants import CONDITIONAL_GET_MAX_AGE
+from recipes.models import DataVersion
 from rest_framework import mixins, viewsets
 
+from .metrics import span
+
+
+class ConditionalGetMixin:
+    """Условные GET-запросы: ETag и Last-Modified строятся по версиям
+        моделей из versioned_models, поэтому ответ 304 отдаётся
+        до выборки данных и работы сериализатора"""
+
+    versioned_models = ()
+
+    def list(self, request, *args, **kwargs):
+
+        return self.conditional_response(
+            super().list, request, *args, **kwargs
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+
+        return self.conditional_response(
+            super().retrieve, request, *args, **kwargs
+        )
+
+    def get_validators(self):
+        """Части ETag и время последнего изменения ответа,
+            None — ответ не кэшируется"""
+
+        versions = DataVersion.objects.get_many(
+            [model._meta.label_lower for model in self.versioned_models]
+        )
+
+        return (
+            [f'{name}:{version}' for name, (version, _) in versions.items()],
+            [modified for _, modified in versions.values()]
+        )
+
+    def conditional_response(self, handler, request, *args, **kwargs):
+
+        validators = self.get_validators()
+        if validators is None:
+
+            return handler(request, *args, **kwargs)
+
+        parts, modified = validators
+        if request.user.is_authenticated:
+            parts.append(f'user:{request.user.pk}')
+        etag = quote_etag(
+            hashlib.md5('|'.join(parts).encode()).hexdigest()
+        )
+        modified = [value for value in modified if value is not None]
+        last_modified = (
+            int(max(modified).timestamp()) if modified else None
+        )
+
+        response = get_conditional_response(
+            request, etag=etag, last_modified=last_modified
+        )
+        if response is None:
+            response = handler(request, *args, **kwargs)
+        if response.status_code not in (200, 304):
+
+            return response
+
+        response['ETag'] = etag
+        if last_modified is not None:
+            response['Last-Modified'] = http_date(last_modified)
+        if request.user.is_authenticated:
+            patch_cache_control(response, private=True, no_cache=True)
+        else:
+            patch_cache_control(
+                response, public=True, max_age=CONDITIONAL_GET_MAX_AGE
+            )
+        patch_vary_headers(response, ('Authorization',))
+
+        return response
+
 
 class RetrieveMixinViewSet(
+    ConditionalGetMixin,
     mixins.RetrieveModelMixin,
     mixins.ListModelMixin,
     viewsets.GenericViewSet
@@ -11,3 +94,20 @@ class RetrieveMixinViewSet(
     pagination_class = None
     filter_backends = [DjangoFilterBackend, ]
     search_fields = ('name',)
+
+
+class TimedSerializerMixin:
+    """Время сериализации попадает в метрики запроса. Переопределённый
+        в подклассе to_representation оборачивается при объявлении
+        класса; вложенные сериализаторы не считаются повторно"""
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        method = cls.__dict__.get('to_representation')
+        if method is not None:
+            cls.to_representation = span('serializer')(method)
+
+    def to_representation(self, instance):
+
+        with span('serializer'):
+            return super().to_representation(instance)
@@ -1,7 +1,338 @@
+import base64
+import binascii
+import hashlib
+import json
+from functools import partial, reduce
+from operator import or_
+
+from django.core.cache import cache
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.core.paginator import (EmptyPage, Page, PageNotAnInteger,
+                                   Paginator)
+from django.db import connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+from foodgram.constants import (COUNT_CACHE_TIMEOUT, COUNT_ESTIMATE_THRESHOLD,
+                                MAXIMUM_PAGE_SIZE)
+from recipes.models import DataVersion
 from rest_framework import pagination
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+def estimated_count(queryset):
+    """Оценка числа строк планировщиком PostgreSQL"""
+
+    sql, params = queryset.query.sql_with_params()
+    with connections[queryset.db].cursor() as cursor:
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+
+    return plan[0]['Plan']['Plan Rows']
+
+
+class CountedPaginator(Paginator):
+    """Paginator с заранее известным числом объектов"""
+
+    def __init__(self, object_list, per_page, count, **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        self.known_count = count
+
+    @cached_property
+    def count(self):
+
+        return self.known_count
+
+
+class EstimatedPage(Page):
+    """Страница, наличие следующей у которой известно по выборке"""
+
+    def __init__(self, object_list, number, paginator, has_more):
+        super().__init__(object_list, number, paginator)
+        self.has_more = has_more
+
+    def has_next(self):
+
+        return self.has_more
+
+
+class EstimatedPaginator(CountedPaginator):
+    """Paginator с оценочным числом объектов: оценка только
+        показывается в ответе, а границы страниц определяются выборкой
+        на одну строку больше страницы. Номер страницы не сверяется
+        с оценкой, пустая страница после первой — 404"""
+
+    def validate_number(self, number):
+
+        try:
+            number = int(number)
+        except (TypeError, ValueError):
+            raise PageNotAnInteger('Номер страницы должен быть числом')
+        if number < 1:
+            raise EmptyPage('Номер страницы меньше 1')
+
+        return number
+
+    def page(self, number):
+
+        number = self.validate_number(number)
+        bottom = (number - 1) * self.per_page
+        rows = list(self.object_list[bottom:bottom + self.per_page + 1])
+        if not rows and number > 1:
+            raise EmptyPage('На этой странице нет результатов')
+
+        return EstimatedPage(
+            rows[:self.per_page], number, self, len(rows) > self.per_page
+        )
 
 
 class MyCustomPagination(pagination.PageNumberPagination):
-    """Кастомный пагинатор"""
+    """Кастомный пагинатор
+        С параметром cursor страницы выбираются по ключу
+        (cursor_ordering представления) без OFFSET: стоимость
+        любой страницы одинакова, формат ответа тот же. Курсор нельзя
+        сочетать с параметрами cursor_excluded_params представления,
+        которые задают собственный порядок, например поиском.
+        Число объектов кэшируется по набору фильтров и версиям моделей
+        count_versioned_models и count_filter_versioned_models,
+        с пользователем — только для выборок, зависящих от него,
+        а для больших выборок в PostgreSQL берётся оценка планировщика:
+        заголовок X-Count-Exact. Оценка не задаёт границы страниц"""
 
     page_size_query_param = 'limit'
+    max_page_size = MAXIMUM_PAGE_SIZE
+    cursor_query_param = 'cursor'
+    cursor_ordering = ('-pub_date', '-id')
+    invalid_cursor_message = 'Неверный курсор'
+    excluded_cursor_message = 'Курсор нельзя сочетать с параметром {}'
+    count_ignored_params = ('page', 'limit', 'cursor', 'format')
+
+    def paginate_queryset(self, queryset, request, view=None):
+
+        if self.cursor_query_param in request.query_params:
+            self.check_cursor_params(request, view)
+        self.count, self.count_exact = self.get_count(queryset, request, view)
+        if self.cursor_query_param not in request.query_params:
+            self.cursor = None
+            self.django_paginator_class = partial(
+                CountedPaginator if self.count_exact else EstimatedPaginator,
+                count=self.count
+            )
+
+            return super().paginate_queryset(queryset, request, view)
+
+        self.request = request
+        self.ordering = getattr(view, 'cursor_ordering', self.cursor_ordering)
+        self.cursor = self.decode_cursor(
+            request.query_params[self.cursor_query_param]
+        )
+        position, reverse = self.cursor
+        page_size = self.get_page_size(request)
+
+        queryset = queryset.order_by(*self.ordering)
+        if reverse:
+            queryset = queryset.reverse()
+        if position is not None:
+            queryset = queryset.filter(
+                self.after_position(queryset.model, position, reverse)
+            )
+        results = list(queryset[:page_size + 1])
+        has_more = len(results) > page_size
+        results = results[:page_size]
+        if reverse:
+            results.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = position is not None
+        self.page_results = results
+
+        return results
+
+    def check_cursor_params(self, request, view):
+
+        for name in getattr(view, 'cursor_excluded_params', ()):
+            if name in request.query_params:
+                raise ValidationError({
+                    self.cursor_query_param: [
+                        self.excluded_cursor_message.format(name)
+                    ]
+                })
+
+    def get_paginated_response(self, data):
+
+        if self.cursor is None:
+            response = super().get_paginated_response(data)
+        else:
+            response = Response({
+                'count': self.count,
+                'next': self.get_next_link(),
+                'previous': self.get_previous_link(),
+                'results': data,
+            })
+        response['X-Count-Exact'] = 'true' if self.count_exact else 'false'
+
+        return response
+
+    def get_count(self, queryset, request, view):
+        """(число объектов, точное ли оно)"""
+
+        versions = DataVersion.objects.get_many([
+            model._meta.label_lower
+            for model in self.count_versioned_models(request, view)
+        ])
+        key = self.count_cache_key(request, view, versions)
+        cached = cache.get(key)
+        if cached is not None:
+
+            return cached
+
+        result = None
+        if connections[queryset.db].vendor == 'postgresql':
+            estimate = estimated_count(queryset)
+            if estimate >= COUNT_ESTIMATE_THRESHOLD:
+                result = estimate, False
+        if result is None:
+            result = queryset.count(), True
+        cache.set(key, result, COUNT_CACHE_TIMEOUT)
+
+        return result
+
+    @staticmethod
+    def count_versioned_models(request, view):
+        """Модели count_versioned_models представления и модели
+            из count_filter_versioned_models для переданных фильтров:
+            изменение избранного не сбрасывает остальные счётчики"""
+
+        models = list(getattr(view, 'count_versioned_models', ()))
+        for name, filter_models in getattr(
+            view, 'count_filter_versioned_models', {}
+        ).items():
+            if name in request.query_params:
+                models.extend(filter_models)
+
+        return models
+
+    @staticmethod
+    def count_user(request, view):
+        """Пользователь для ключа числа объектов: только когда выборка
+            зависит от него — count_per_user представления или фильтры
+            count_user_params. Иначе число общее для всех"""
+
+        if getattr(view, 'count_per_user', False) or any(
+            name in request.query_params
+            for name in getattr(view, 'count_user_params', ())
+        ):
+
+            return request.user.pk
+
+        return None
+
+    def count_cache_key(self, request, view, versions):
+        """Ключ по пути, пользователю, отсортированным фильтрам
+            и версиям моделей"""
+
+        params = sorted(
+            (name, sorted(values))
+            for name, values in request.query_params.lists()
+            if name not in self.count_ignored_params
+        )
+        raw = json.dumps(
+            [
+                request.path,
+                self.count_user(request, view),
+                params,
+                sorted(
+                    (name, version)
+                    for name, (version, _) in versions.items()
+                ),
+            ],
+            ensure_ascii=False
+        )
+
+        return 'list-count:' + hashlib.md5(raw.encode()).hexdigest()
+
+    def get_next_link(self):
+
+        if self.cursor is None:
+
+            return super().get_next_link()
+
+        if not self.has_next or not self.page_results:
+
+            return None
+
+        return self.cursor_link(self.page_results[-1], reverse=False)
+
+    def get_previous_link(self):
+
+        if self.cursor is None:
+
+            return super().get_previous_link()
+
+        if not self.has_previous or not self.page_results:
+
+            return None
+
+        return self.cursor_link(self.page_results[0], reverse=True)
+
+    def cursor_link(self, instance, reverse):
+
+        url = remove_query_param(
+            self.request.build_absolute_uri(), self.page_query_param
+        )
+        position = [
+            str(getattr(instance, field.lstrip('-')))
+            for field in self.ordering
+        ]
+        token = base64.urlsafe_b64encode(
+            json.dumps({'p': position, 'r': reverse}).encode()
+        ).decode()
+
+        return replace_query_param(url, self.cursor_query_param, token)
+
+    def decode_cursor(self, token):
+        """(позиция, обратное направление); пустой курсор —
+            первая страница"""
+
+        if not token:
+
+            return None, False
+
+        try:
+            data = json.loads(base64.urlsafe_b64decode(token.encode()))
+            position, reverse = data['p'], data['r']
+        except (binascii.Error, ValueError, TypeError, KeyError):
+            raise NotFound(self.invalid_cursor_message)
+
+        if (
+            not isinstance(position, list)
+            or len(position) != len(self.ordering)
+            or not all(isinstance(value, str) for value in position)
+            or not isinstance(reverse, bool)
+        ):
+            raise NotFound(self.invalid_cursor_message)
+
+        return position, reverse
+
+    def after_position(self, model, position, reverse):
+        """Условие «строго после позиции» в порядке ordering:
+            (a < x) OR (a = x AND b < y) OR ..."""
+
+        conditions = []
+        equal = Q()
+        for field, value in zip(self.ordering, position):
+            name = field.lstrip('-')
+            try:
+                value = model._meta.get_field(name).to_python(value)
+            except (TypeError, ValueError, DjangoValidationError):
+                raise NotFound(self.invalid_cursor_message)
+            descending = field.startswith('-') != reverse
+            lookup = 'lt' if descending else 'gt'
+            conditions.append(equal & Q(**{f'{name}__{lookup}': value}))
+            equal &= Q(**{name: value})
+
+        return reduce(or_, conditions)
@@ -1,18 +1,41 @@
 import base64
+import binascii
+import io
 
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import (InMemoryUploadedFile,
+                                            TemporaryUploadedFile)
+from django.db import models, transaction
+from django.db.models import prefetch_related_objects
 from djoser.serializers import UserCreateSerializer, UserSerializer
-from foodgram.constants import (MINIMUM_COOCING_TIME_IN_MINUTES,
+from foodgram.constants import (ALLOWED_IMAGE_FORMATS, MAXIMUM_IMAGE_DIMENSION,
+                                MAXIMUM_IMAGE_SIZE,
+                                MAXIMUM_SUBSCRIPTION_RECIPES_LIMIT,
+                                MINIMUM_COOCING_TIME_IN_MINUTES,
                                 MINIMUM_RECIPE_INGREDIENTS_AMOUNT)
-from recipes.models import (Favourites, Ingredient, RecipeIngredientsAmount,
-                            Recipes, ShoppingList, Tag)
+from PIL import ImageFile
+from recipes.images import PLACEHOLDER_KEY
+from recipes.models import (DataVersion, Favourites, Ingredient,
+                            RecipeIngredientsAmount, Recipes,
+                            ShoppingCartIngredient, ShoppingList, Tag,
+                            recipe_relations, recipe_relations_batch,
+                            set_prefetched)
 from rest_framework import serializers
 from rest_framework.exceptions import ValidationError
 from users.models import Subscription
 
+from .cache import recipe_representations
+from .mixins import TimedSerializerMixin
+
 User = get_user_model()
 
+BASE64_CHUNK_SIZE = 64 * 1024
+BASE64_SEPARATOR = ';base64,'
+BASE64_WHITESPACE = ' \t\r\n'
+BASE64_STRIP = str.maketrans('', '', BASE64_WHITESPACE)
+
 
 class UserCreateSerializer(UserCreateSerializer):
     """Преобразование данных класса User
@@ -30,7 +53,7 @@ class UserCreateSerializer(UserCreateSerializer):
         )
 
 
-class UsersListSerializer(UserSerializer):
+class UsersListSerializer(TimedSerializerMixin, UserSerializer):
     """Преобразование списка пользователей"""
 
     is_subscribed = serializers.SerializerMethodField()
@@ -53,6 +76,10 @@ class UsersListSerializer(UserSerializer):
 
     def get_is_subscribed(self, obj):
 
+        if hasattr(obj, 'is_subscribed'):
+
+            return obj.is_subscribed
+
         request = self.context.get('request')
         if not request or request.user.is_anonymous:
 
@@ -65,24 +92,141 @@ class UsersListSerializer(UserSerializer):
 
 class Base64ImageField(serializers.ImageField):
     """Преобразование данных
-        Кастомное поле для картинки"""
+        Кастомное поле для картинки
+        base64 декодируется частями во временный файл: небольшие
+        картинки остаются в памяти, большие пишутся на диск. Формат
+        и размеры проверяются по заголовку до декодирования остального.
+        Переносы строк и пробелы внутри base64 допускаются"""
 
     def to_internal_value(self, data):
 
         if isinstance(data, str) and data.startswith('data:image'):
-
-            format, imgstr = data.split(';base64,')
-            ext = format.split('/')[-1]
-            data = ContentFile(base64.b64decode(imgstr), name='temp.' + ext)
+            data = self.decode(data)
 
         return super(Base64ImageField, self).to_internal_value(data)
 
+    def decode(self, data):
+
+        separator = data.find(BASE64_SEPARATOR)
+        start = separator + len(BASE64_SEPARATOR)
+        length = len(data) - start - sum(
+            data.count(character, start) for character in BASE64_WHITESPACE
+        )
+        if separator < 0 or length % 4:
+            raise ValidationError('Картинка должна быть в формате base64')
+        size = length // 4 * 3
+        if size > MAXIMUM_IMAGE_SIZE:
+            raise ValidationError(
+                'Размер картинки больше {} МБ'.format(
+                    MAXIMUM_IMAGE_SIZE // (1024 * 1024)
+                )
+            )
+
+        file = self.temporary_file(data[len('data:'):separator], size)
+        try:
+            self.write_decoded(file, data, start)
+        except (binascii.Error, OSError, SyntaxError, ValueError):
+            file.close()
+            raise ValidationError('Не удалось распознать картинку')
+        except ValidationError:
+            file.close()
+            raise
+
+        file.size = file.tell()
+        file.seek(0)
+
+        return file
+
+    @staticmethod
+    def temporary_file(content_type, size):
+
+        if size > settings.FILE_UPLOAD_MAX_MEMORY_SIZE:
+
+            return TemporaryUploadedFile('temp', content_type, 0, None)
+
+        return InMemoryUploadedFile(
+            io.BytesIO(), None, 'temp', content_type, 0, None
+        )
+
+    def write_decoded(self, file, data, start):
+        """Декодирует base64 частями без копии всей строки; заголовок
+            картинки разбирается по мере поступления первых частей.
+            Из части удаляются пробельные символы, а остаток, не кратный
+            четырём символам, переносится в следующую часть"""
+
+        parser = ImageFile.Parser()
+        rest = ''
+        for position in range(start, len(data), BASE64_CHUNK_SIZE):
+            text = rest + data[
+                position:position + BASE64_CHUNK_SIZE
+            ].translate(BASE64_STRIP)
+            aligned = len(text) - len(text) % 4
+            rest = text[aligned:]
+            chunk = base64.b64decode(text[:aligned], validate=True)
+            if parser is not None:
+                parser.feed(chunk)
+                if parser.image is not None:
+                    self.check_header(parser.image)
+                    file.name = 'temp.' + parser.image.format.lower()
+                    parser = None
+            file.write(chunk)
+        if parser is not None:
+            raise ValidationError('Не удалось распознать картинку')
+
+    @staticmethod
+    def check_header(image):
+
+        if image.format not in ALLOWED_IMAGE_FORMATS:
+            raise ValidationError(
+                'Допустимые форматы картинки: {}'.format(
+                    ', '.join(ALLOWED_IMAGE_FORMATS)
+                )
+            )
+        if max(image.size) > MAXIMUM_IMAGE_DIMENSION:
+            raise ValidationError(
+                'Ширина и высота картинки не больше {} пикселей'.format(
+                    MAXIMUM_IMAGE_DIMENSION
+                )
+            )
+
+
+class ImageVariantsField(serializers.ReadOnlyField):
+    """Варианты картинки рецепта: ссылки на уменьшенные копии
+        по ширине и размытая заглушка в виде data URI"""
+
+    def to_representation(self, value):
+
+        return self.absolute(
+            {
+                key: variant if key == PLACEHOLDER_KEY
+                else default_storage.url(variant)
+                for key, variant in (value or {}).items()
+            },
+            self.context.get('request')
+        )
+
+    @staticmethod
+    def absolute(images, request):
+
+        if request is None:
+
+            return images
+
+        return {
+            key: variant if key == PLACEHOLDER_KEY
+            else request.build_absolute_uri(variant)
+            for key, variant in images.items()
+        }
 
-class NoneIngredientsRecipeSerializer(serializers.ModelSerializer):
+
+class NoneIngredientsRecipeSerializer(
+    TimedSerializerMixin, serializers.ModelSerializer
+):
     """Преобразование данных
         Рецепт без ингредиента"""
 
     image = Base64ImageField(read_only=True)
+    images = ImageVariantsField()
     name = serializers.ReadOnlyField()
     cooking_time = serializers.ReadOnlyField()
 
@@ -92,6 +236,7 @@ class NoneIngredientsRecipeSerializer(serializers.ModelSerializer):
             'id',
             'name',
             'image',
+            'images',
             'cooking_time'
         )
 
@@ -102,7 +247,6 @@ class SubscriptionsSerializer(UsersListSerializer):
 
     recipes = serializers.SerializerMethodField()
     recipes_count = serializers.SerializerMethodField()
-    is_subscribed = serializers.SerializerMethodField()
 
     class Meta:
         model = Subscription
@@ -145,36 +289,47 @@ class SubscriptionsSerializer(UsersListSerializer):
 
         return data
 
+    @staticmethod
+    def parse_recipes_limit(request):
+        """Значение recipes_limit, ограниченное сверху"""
+
+        limit = request.query_params.get('recipes_limit')
+        if limit is None or limit == '':
+
+            return MAXIMUM_SUBSCRIPTION_RECIPES_LIMIT
+
+        try:
+            limit = int(limit)
+        except ValueError:
+            limit = -1
+        if limit < 0:
+            raise ValidationError(
+                {'recipes_limit': 'Ожидается целое неотрицательное число!'}
+            )
+
+        return min(limit, MAXIMUM_SUBSCRIPTION_RECIPES_LIMIT)
+
     def get_recipes(self, obj):
         request = self.context.get('request')
-        limit = request.query_params.get('recipes_limit')
-        recipes = Recipes.objects.filter(author=obj).all()
-        if limit:
-            recipes = recipes[:int(limit)]
+        recipes_by_author = self.context.get('recipes_by_author')
+        if recipes_by_author is not None:
+            recipes = recipes_by_author.get(obj.id, [])
+        else:
+            recipes = Recipes.objects.filter(author=obj).order_by(
+                '-pub_date', '-id'
+            )[:self.parse_recipes_limit(request)]
         serializer = NoneIngredientsRecipeSerializer(
             recipes, many=True, read_only=True,
             context={'request': request}
         )
         return serializer.data
 
-    def get_is_subscribed(self, obj):
-
-        try:
-            return Subscription.objects.filter(
-                user=self.context.get('request'),
-                blogger_id=obj.id
-            ).exists()
-
-        except Exception:
-
-            return False
-
     def get_recipes_count(self, obj):
 
-        return obj.recipes.count()
+        return obj.recipes_count
 
 
-class TagSerializer(serializers.ModelSerializer):
+class TagSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     """Преобразование данных
         Список тегов"""
 
@@ -188,7 +343,9 @@ class TagSerializer(serializers.ModelSerializer):
         )
 
 
-class IngridientSerializer(serializers.ModelSerializer):
+class IngridientSerializer(
+    TimedSerializerMixin, serializers.ModelSerializer
+):
     """Преобразование данных
         Список ингредиентов"""
 
@@ -222,22 +379,75 @@ class IngredientAmountSerializer(serializers.ModelSerializer):
         )
 
 
-class RecipeSerializer(serializers.ModelSerializer):
+class RecipeListSerializer(
+    TimedSerializerMixin, serializers.ListSerializer
+):
+    """Список рецептов: кэшированные представления читаются
+        одним запросом к кэшу на страницу"""
+
+    def to_representation(self, data):
+
+        recipes = list(
+            data.all() if isinstance(data, models.Manager) else data
+        )
+        self.child.load_shared(recipes)
+
+        return super().to_representation(recipes)
+
+
+class RecipeSharedSerializer(
+    TimedSerializerMixin, serializers.ModelSerializer
+):
     """Преобразование данных
-        Получение списка рецептов"""
+        Общая для всех пользователей часть рецепта"""
 
-    image = Base64ImageField(required=False, allow_null=True)
+    image = Base64ImageField(read_only=True)
+    images = ImageVariantsField()
     tags = TagSerializer(many=True, read_only=True)
     author = UsersListSerializer(many=False, read_only=True)
     ingredients = IngredientAmountSerializer(
         many=True,
         source='recipeingredientsamount_set'
     )
+
+    class Meta:
+        model = Recipes
+        fields = (
+            'id',
+            'tags',
+            'author',
+            'ingredients',
+            'name',
+            'image',
+            'images',
+            'text',
+            'cooking_time'
+        )
+
+    @classmethod
+    def build(cls, recipes):
+        """Представления рецептов; связи загружаются только
+            для рецептов, которых нет в кэше"""
+
+        prefetch_related_objects(recipes, *recipe_relations())
+        serializer = cls(context={})
+
+        return {
+            recipe.pk: serializer.to_representation(recipe)
+            for recipe in recipes
+        }
+
+
+class RecipeSerializer(RecipeSharedSerializer):
+    """Преобразование данных
+        Получение списка рецептов"""
+
     is_favorited = serializers.SerializerMethodField()
     is_in_shopping_cart = serializers.SerializerMethodField()
 
     class Meta:
         model = Recipes
+        list_serializer_class = RecipeListSerializer
         fields = (
             'id',
             'tags',
@@ -247,14 +457,68 @@ class RecipeSerializer(serializers.ModelSerializer):
             'is_in_shopping_cart',
             'name',
             'image',
+            'images',
             'text',
             'cooking_time'
         )
 
+    def load_shared(self, recipes):
+
+        self._shared = recipe_representations.get_many(
+            recipes, RecipeSharedSerializer.build
+        )
+
+    def to_representation(self, instance):
+
+        shared = getattr(self, '_shared', {}).get(instance.pk)
+        if shared is None:
+            shared = recipe_representations.get_many(
+                [instance], RecipeSharedSerializer.build
+            )[instance.pk]
+
+        request = self.context.get('request')
+        personal = {
+            'author': shared['author'] and dict(
+                shared['author'],
+                is_subscribed=self.get_author_is_subscribed(instance)
+            ),
+            'is_favorited': self.get_is_favorited(instance),
+            'is_in_shopping_cart': self.get_is_in_shopping_cart(instance),
+        }
+        if shared['image'] and request is not None:
+            personal['image'] = request.build_absolute_uri(shared['image'])
+        personal['images'] = ImageVariantsField.absolute(
+            shared['images'], request
+        )
+
+        return {
+            field: personal[field] if field in personal else shared[field]
+            for field in self.Meta.fields
+        }
+
+    def get_author_is_subscribed(self, obj):
+
+        if hasattr(obj, 'author_is_subscribed'):
+
+            return obj.author_is_subscribed
+
+        request = self.context.get('request')
+        if request is None or request.user.is_anonymous:
+
+            return False
+
+        return Subscription.objects.filter(
+            user=request.user, author_id=obj.author_id
+        ).exists()
+
     def get_is_favorited(self, obj):
 
+        if hasattr(obj, 'is_favorited'):
+
+            return obj.is_favorited
+
         request = self.context.get('request')
-        if request.user.is_anonymous or request is None:
+        if request is None or request.user.is_anonymous:
 
             return False
 
@@ -264,8 +528,12 @@ class RecipeSerializer(serializers.ModelSerializer):
 
     def get_is_in_shopping_cart(self, obj):
 
+        if hasattr(obj, 'is_in_shopping_cart'):
+
+            return obj.is_in_shopping_cart
+
         request = self.context.get('request')
-        if request.user.is_anonymous or request is None:
+        if request is None or request.user.is_anonymous:
 
             return False
 
@@ -275,7 +543,9 @@ class RecipeSerializer(serializers.ModelSerializer):
         ).exists()
 
 
-class RecipeCreateSerializer(serializers.ModelSerializer):
+class RecipeCreateSerializer(
+    TimedSerializerMixin, serializers.ModelSerializer
+):
     """Преобразование данных
         Создание рецепта"""
 
@@ -295,39 +565,46 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
     cooking_time = serializers.IntegerField()
 
     def validate(self, attrs):
-        tags = []
 
-        for tag in attrs['tags']:
-
-            if tag not in tags:
-                tags.append(tag)
-            else:
-                raise serializers.ValidationError(
-                    {'tags': 'Тег должен быть уникальным!'}
-                )
+        tags = attrs['tags']
+        if len(set(tags)) != len(tags):
+            raise serializers.ValidationError(
+                {'tags': 'Тег должен быть уникальным!'}
+            )
         if not tags:
             raise serializers.ValidationError(
                 {'tags': 'Должен быть выбран хотя бы один тег!'}
             )
 
-        ingredients = []
-
-        for ingredient in attrs['recipeingredientsamount_set']:
-
-            if ingredient['ingredient'] in ingredients:
-                raise serializers.ValidationError(
-                    {'ingredients': 'Ингредиент должен быть уникальным!'}
-                )
-            ingredients.append(ingredient['ingredient'])
-
+        ingredients = attrs['recipeingredientsamount_set']
+        if not ingredients:
+            raise serializers.ValidationError(
+                {'ingredients': 'Укажите хотя бы 1 ингридиент!'}
+            )
+        ingredient_ids = [
+            ingredient['ingredient']['id'] for ingredient in ingredients
+        ]
+        if len(set(ingredient_ids)) != len(ingredient_ids):
+            raise serializers.ValidationError(
+                {'ingredients': 'Ингредиент должен быть уникальным!'}
+            )
+        for ingredient in ingredients:
             if int(ingredient['amount']) < MINIMUM_RECIPE_INGREDIENTS_AMOUNT:
                 raise serializers.ValidationError(
                     {'amount': 'Мера объёма|веса не может быть меньше 1!'}
                 )
-        if not ingredients:
+
+        found = Ingredient.objects.in_bulk(ingredient_ids)
+        unknown = [pk for pk in ingredient_ids if pk not in found]
+        if unknown:
             raise serializers.ValidationError(
-                {'ingredients': 'Укажите хотя бы 1 ингридиент!'}
+                {'ingredients': 'Несуществующие ингредиенты: {}'.format(
+                    ', '.join(str(pk) for pk in unknown)
+                )}
             )
+        for ingredient in ingredients:
+            ingredient['ingredient'] = found[ingredient['ingredient']['id']]
+
         if int(attrs['cooking_time']) < MINIMUM_COOCING_TIME_IN_MINUTES:
             raise serializers.ValidationError(
                 {'cooking_time': 'Минимальное время приготовления 1 минута!'}
@@ -335,45 +612,116 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
 
         return attrs
 
+    @transaction.atomic
     def create(self, validated_data):
 
         tag_data = validated_data.pop('tags')
         ingredients = validated_data.pop('recipeingredientsamount_set')
         recipes = Recipes.objects.create(**validated_data)
         recipes.tags.set(tag_data)
-        self.recipes_ingredients_add(ingredients, recipes)
+        self.loaded_relations = (
+            tag_data, self.recipes_ingredients_add(ingredients, recipes)
+        )
 
         return recipes
 
+    @transaction.atomic
     def update(self, instance, validated_data):
+        """Теги и количества ингредиентов сравниваются с сохранёнными:
+            изменяются только отличающиеся строки"""
 
-        instance.tags.clear()
-        RecipeIngredientsAmount.objects.filter(recipes=instance).delete()
         tags = validated_data.pop('tags')
-        instance.tags.set(tags)
         ingredients = validated_data.pop('recipeingredientsamount_set')
-        self.recipes_ingredients_add(ingredients, instance)
+
+        stored_tags = set(instance.tags.values_list('id', flat=True))
+        tag_ids = {tag.id for tag in tags}
+        if tag_ids - stored_tags:
+            instance.tags.add(*(tag_ids - stored_tags))
+        if stored_tags - tag_ids:
+            instance.tags.remove(*(stored_tags - tag_ids))
+
+        stored = {
+            amount.ingredient_id: amount
+            for amount in RecipeIngredientsAmount.objects.filter(
+                recipes=instance
+            ).select_related('ingredient')
+        }
+        old_amounts = {
+            ingredient_id: amount.amount
+            for ingredient_id, amount in stored.items()
+        }
+        amounts, created, changed = [], [], []
+        for ingredient in ingredients:
+            amount = stored.pop(ingredient['ingredient'].id, None)
+            if amount is None:
+                amount = RecipeIngredientsAmount(
+                    ingredient=ingredient['ingredient'],
+                    recipes=instance,
+                    amount=ingredient['amount']
+                )
+                created.append(amount)
+            elif amount.amount != ingredient['amount']:
+                amount.amount = ingredient['amount']
+                changed.append(amount)
+            amounts.append(amount)
+
+        if created or changed or stored:
+            RecipeIngredientsAmount.objects.bulk_create(created)
+            RecipeIngredientsAmount.objects.bulk_update(changed, ['amount'])
+            with recipe_relations_batch():
+                RecipeIngredientsAmount.objects.filter(
+                    pk__in=[amount.pk for amount in stored.values()]
+                ).delete()
+            DataVersion.objects.bump(
+                RecipeIngredientsAmount._meta.label_lower
+            )
+            ShoppingCartIngredient.objects.change_recipe(
+                instance,
+                old_amounts,
+                {amount.ingredient_id: amount.amount for amount in amounts}
+            )
+        self.loaded_relations = (tags, amounts)
 
         return super().update(instance, validated_data)
 
     def to_representation(self, instance):
+        """Теги и ингредиенты берутся из только что записанных
+            объектов, отметки пользователя — одним запросом"""
+
+        request = self.context.get('request')
+        recipe = (
+            Recipes.objects
+            .select_related('author')
+            .with_user_flags(request.user)
+            .get(pk=instance.pk)
+        )
+        if hasattr(self, 'loaded_relations'):
+            tags, amounts = self.loaded_relations
+            set_prefetched(
+                recipe, 'tags', sorted(tags, key=lambda tag: -tag.id)
+            )
+            set_prefetched(recipe, 'recipeingredientsamount_set', amounts)
+
         return RecipeSerializer(
-            instance,
-            context={'request': self.context.get('request')}
+            recipe,
+            context={'request': request}
         ).data
 
     @staticmethod
     def recipes_ingredients_add(ingredients, recipes):
+        """Количества ингредиентов одним INSERT; bulk_create не
+            отправляет сигналы, поэтому версия данных повышается явно"""
 
-        for ingredient in ingredients:
-            current_ingredient = (
-                Ingredient.objects.get(id=ingredient['ingredient']['id'])
-            )
-            RecipeIngredientsAmount.objects.create(
-                ingredient=current_ingredient,
+        DataVersion.objects.bump(RecipeIngredientsAmount._meta.label_lower)
+
+        return RecipeIngredientsAmount.objects.bulk_create(
+            RecipeIngredientsAmount(
+                ingredient=ingredient['ingredient'],
                 recipes=recipes,
                 amount=ingredient['amount']
             )
+            for ingredient in ingredients
+        )
 
     class Meta:
         model = Recipes
@@ -0,0 +1,482 @@
+import base64
+import io
+import json
+import os
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connection
+from django.core.paginator import EmptyPage
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from PIL import Image
+from django.db.models import Sum
+from recipes.models import (Favourites, Ingredient, RecipeIngredientsAmount,
+                            Recipes, ShoppingCartIngredient, ShoppingList,
+                            Tag)
+from rest_framework.test import APIClient
+from users.models import User
+
+from .pagination import EstimatedPaginator
+from .serializers import Base64ImageField
+
+MEDIA_ROOT = tempfile.mkdtemp()
+RECIPES_COUNT = 35
+NO_API_LOG = dict(settings.API_LOG, SAMPLE_RATE=0, SAMPLE_RATES={})
+
+
+def image_data():
+    """Картинка PNG в формате data URI, как её присылает фронтенд"""
+
+    buffer = io.BytesIO()
+    Image.new('RGB', (40, 30), (255, 0, 0)).save(buffer, 'PNG')
+
+    return 'data:image/png;base64,' + base64.b64encode(
+        buffer.getvalue()
+    ).decode()
+
+
+@override_settings(
+    MEDIA_ROOT=MEDIA_ROOT,
+    API_LOG=NO_API_LOG,
+)
+class RecipeQueriesTest(TestCase):
+    """Число SQL-запросов к рецептам не зависит от размера страницы
+        и числа ингредиентов рецепта. Кэши очищаются перед каждым
+        тестом, поэтому считаются запросы без попаданий в кэш"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(
+            username='author', email='author@foodgram.ru',
+            password='author-password', first_name='Автор', last_name='Автор'
+        )
+        cls.reader = User.objects.create_user(
+            username='reader', email='reader@foodgram.ru',
+            password='reader-password', first_name='Читатель',
+            last_name='Читатель'
+        )
+        cls.tags = [
+            Tag.objects.create(
+                name=f'Тег {number}', color='#E26C2D', slug=f'tag{number}'
+            )
+            for number in range(3)
+        ]
+        cls.ingredients = [
+            Ingredient.objects.create(
+                name=f'Ингредиент {number}', measurement_unit='г'
+            )
+            for number in range(10)
+        ]
+        for number in range(RECIPES_COUNT):
+            recipe = Recipes.objects.create(
+                author=cls.author,
+                name=f'Рецепт {number}',
+                text='Суп с картошкой',
+                image='recipes/test.png',
+                cooking_time=5,
+            )
+            recipe.tags.set(cls.tags[:2])
+            RecipeIngredientsAmount.objects.bulk_create(
+                RecipeIngredientsAmount(
+                    recipes=recipe, ingredient=ingredient, amount=10
+                )
+                for ingredient in cls.ingredients[:3]
+            )
+        cls.recipe = recipe
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        for alias in ('default', 'recipes'):
+            caches[alias].clear()
+        self.anonymous = APIClient()
+        self.client = APIClient()
+        self.client.force_authenticate(self.reader)
+        self.author_client = APIClient()
+        self.author_client.force_authenticate(self.author)
+
+    def assert_list_queries(self, client, number):
+
+        for limit in (1, 30):
+            with self.subTest(limit=limit):
+                caches['default'].clear()
+                caches['recipes'].clear()
+                with self.assertNumQueries(number):
+                    response = client.get('/api/recipes/', {'limit': limit})
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(len(response.data['results']), limit)
+
+    def test_list_anonymous(self):
+        """Версии, число рецептов, страница, теги, ингредиенты"""
+
+        self.assert_list_queries(self.anonymous, 5)
+
+    def test_list_authenticated(self):
+        """Отметки пользователя вычисляются в запросе страницы"""
+
+        self.assert_list_queries(self.client, 5)
+
+    def test_retrieve(self):
+
+        for client, number in ((self.anonymous, 4), (self.client, 5)):
+            with self.subTest(authenticated=client is self.client):
+                caches['recipes'].clear()
+                with self.assertNumQueries(number):
+                    response = client.get(f'/api/recipes/{self.recipe.pk}/')
+                self.assertEqual(response.status_code, 200)
+
+    def test_count_cache_with_favourites(self):
+        """Избранное не сбрасывает закэшированное число рецептов
+            без фильтра is_favorited, с фильтром число пересчитывается"""
+
+        self.client.get('/api/recipes/')
+        with CaptureQueriesContext(connection) as cached:
+            self.client.get('/api/recipes/')
+        Favourites.objects.create(user=self.reader, recipe=self.recipe)
+
+        with self.assertNumQueries(len(cached)):
+            self.client.get('/api/recipes/')
+        response = self.client.get('/api/recipes/', {'is_favorited': 1})
+        self.assertEqual(response.data['count'], 1)
+        Favourites.objects.filter(user=self.reader).delete()
+        response = self.client.get('/api/recipes/', {'is_favorited': 1})
+        self.assertEqual(response.data['count'], 0)
+
+    def count_queries(self, client, params):
+
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get('/api/recipes/', params)
+        self.assertEqual(response.status_code, 200)
+
+        return sum(
+            'COUNT(' in query['sql'] for query in queries.captured_queries
+        )
+
+    def test_count_cache_shared_between_users(self):
+        """Число без фильтров пользователя общее для всех, с фильтром
+            избранного — своё у каждого пользователя"""
+
+        self.assertEqual(self.count_queries(self.anonymous, {}), 1)
+        self.assertEqual(self.count_queries(self.client, {}), 0)
+        self.assertEqual(
+            self.count_queries(self.author_client, {'is_favorited': 1}), 1
+        )
+        self.assertEqual(
+            self.count_queries(self.client, {'is_favorited': 1}), 1
+        )
+
+    def test_etag_after_favourite_and_cart(self):
+        """ETag рецепта меняется при добавлении в избранное и в список
+            покупок и при удалении из них, старый ETag не даёт 304"""
+
+        url = f'/api/recipes/{self.recipe.pk}/'
+        etags = [self.client.get(url)['ETag']]
+        for action in ('favorite', 'shopping_cart'):
+            for method, status in (('post', 201), ('delete', 204)):
+                with self.subTest(action=action, method=method):
+                    response = getattr(self.client, method)(f'{url}{action}/')
+                    self.assertEqual(response.status_code, status)
+                    response = self.client.get(
+                        url, HTTP_IF_NONE_MATCH=etags[-1]
+                    )
+                    self.assertEqual(response.status_code, 200)
+                    self.assertNotIn(response['ETag'], etags)
+                    etags.append(response['ETag'])
+
+    def recipe_data(self, ingredients_count, amount=5):
+
+        return {
+            'tags': [tag.pk for tag in self.tags[:2]],
+            'ingredients': [
+                {'id': ingredient.pk, 'amount': amount}
+                for ingredient in self.ingredients[:ingredients_count]
+            ],
+            'name': 'Новый рецепт',
+            'text': 'Суп с картошкой',
+            'cooking_time': 10,
+            'image': image_data(),
+        }
+
+    def create_recipe(self, ingredients_count):
+
+        response = self.author_client.post(
+            '/api/recipes/', self.recipe_data(ingredients_count), format='json'
+        )
+        self.assertEqual(response.status_code, 201)
+
+        return response
+
+    def test_create(self):
+        """Ответ собирается из сохранённых объектов без повторных
+            запросов по числу ингредиентов. Первый рецепт создаёт
+            строки версий и картинки, поэтому не считается"""
+
+        self.create_recipe(1)
+        for ingredients_count in (1, 10):
+            with self.subTest(ingredients=ingredients_count):
+                with self.assertNumQueries(19):
+                    response = self.create_recipe(ingredients_count)
+                self.assertEqual(
+                    len(response.data['ingredients']), ingredients_count
+                )
+
+    def test_update(self):
+        """Изменение количества тех же ингредиентов"""
+
+        for ingredients_count in (1, 10):
+            with self.subTest(ingredients=ingredients_count):
+                recipe_id = self.create_recipe(ingredients_count).data['id']
+                data = self.recipe_data(ingredients_count, amount=7)
+                del data['image']
+                with self.assertNumQueries(17):
+                    response = self.author_client.patch(
+                        f'/api/recipes/{recipe_id}/', data, format='json'
+                    )
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(
+                    [item['amount'] for item in response.data['ingredients']],
+                    [7] * ingredients_count
+                )
+
+
+@override_settings(API_LOG=NO_API_LOG)
+class ShoppingCartTest(TestCase):
+    """Сводный список покупок совпадает с суммой ингредиентов рецептов
+        из списка покупок, как бы ни менялись список и рецепты"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(
+            username='author', email='author@foodgram.ru',
+            password='author-password', first_name='Автор', last_name='Автор'
+        )
+        cls.buyer = User.objects.create_user(
+            username='buyer', email='buyer@foodgram.ru',
+            password='buyer-password', first_name='Покупатель',
+            last_name='Покупатель'
+        )
+        cls.tag = Tag.objects.create(
+            name='Обед', color='#E26C2D', slug='lunch'
+        )
+        cls.ingredients = [
+            Ingredient.objects.create(
+                name=f'Ингредиент {number}', measurement_unit='г'
+            )
+            for number in range(4)
+        ]
+        cls.recipes = []
+        for number, amounts in enumerate(((100, 20, 0), (50, 0, 7))):
+            recipe = Recipes.objects.create(
+                author=cls.author,
+                name=f'Рецепт {number}',
+                text='Суп с картошкой',
+                image='recipes/test.png',
+                cooking_time=5,
+            )
+            recipe.tags.set([cls.tag])
+            RecipeIngredientsAmount.objects.bulk_create(
+                RecipeIngredientsAmount(
+                    recipes=recipe, ingredient=ingredient, amount=amount
+                )
+                for ingredient, amount in zip(cls.ingredients, amounts)
+                if amount
+            )
+            cls.recipes.append(recipe)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.buyer)
+        self.author_client = APIClient()
+        self.author_client.force_authenticate(self.author)
+
+    def assert_cart(self):
+
+        expected = dict(
+            RecipeIngredientsAmount.objects
+            .filter(recipes__shopping_list__user=self.buyer)
+            .order_by()
+            .values('ingredient')
+            .annotate(total=Sum('amount'))
+            .values_list('ingredient', 'total')
+        )
+        self.assertEqual(
+            dict(
+                ShoppingCartIngredient.objects
+                .filter(user=self.buyer)
+                .values_list('ingredient', 'amount')
+            ),
+            expected
+        )
+
+        return expected
+
+    def add_to_cart(self, recipe):
+
+        response = self.client.post(f'/api/recipes/{recipe.pk}/shopping_cart/')
+        self.assertEqual(response.status_code, 201)
+
+    def test_add_and_remove(self):
+
+        for recipe in self.recipes:
+            self.add_to_cart(recipe)
+        self.assertEqual(self.assert_cart()[self.ingredients[0].pk], 150)
+
+        response = self.client.delete(
+            f'/api/recipes/{self.recipes[0].pk}/shopping_cart/'
+        )
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.assert_cart()[self.ingredients[0].pk], 50)
+
+    def test_orm_changes(self):
+        """Строки списка покупок из админки или кода без API"""
+
+        item = ShoppingList.objects.create(
+            user=self.buyer, recipe=self.recipes[1]
+        )
+        self.assertTrue(self.assert_cart())
+
+        item.delete()
+        self.assertEqual(self.assert_cart(), {})
+
+    def test_recipe_edit(self):
+
+        for recipe in self.recipes:
+            self.add_to_cart(recipe)
+        response = self.author_client.patch(
+            f'/api/recipes/{self.recipes[0].pk}/',
+            {
+                'tags': [self.tag.pk],
+                'ingredients': [
+                    {'id': self.ingredients[0].pk, 'amount': 300},
+                    {'id': self.ingredients[3].pk, 'amount': 4},
+                ],
+                'name': 'Рецепт 0',
+                'text': 'Суп с картошкой',
+                'cooking_time': 5,
+            },
+            format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+
+        cart = self.assert_cart()
+        self.assertEqual(cart[self.ingredients[0].pk], 350)
+        self.assertNotIn(self.ingredients[1].pk, cart)
+
+    def test_recipe_delete(self):
+
+        for recipe in self.recipes:
+            self.add_to_cart(recipe)
+        response = self.author_client.delete(
+            f'/api/recipes/{self.recipes[0].pk}/'
+        )
+        self.assertEqual(response.status_code, 204)
+
+        self.assertEqual(self.assert_cart()[self.ingredients[0].pk], 50)
+
+
+@override_settings(API_LOG=NO_API_LOG)
+class RecipeSearchTest(TestCase):
+    """Поиск по основам слов: другая форма слова находит рецепт"""
+
+    def test_stemmed_match(self):
+
+        author = User.objects.create_user(
+            username='author', email='author@foodgram.ru',
+            password='author-password', first_name='Автор', last_name='Автор'
+        )
+        found = Recipes.objects.create(
+            author=author, name='Пюре', text='Отварить картошку и размять',
+            cooking_time=10, image='recipes/test.png'
+        )
+        Recipes.objects.create(
+            author=author, name='Салат', text='Нарезать огурцы',
+            cooking_time=10, image='recipes/test.png'
+        )
+
+        response = APIClient().get('/api/recipes/', {'search': 'картошки'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [recipe['id'] for recipe in response.data['results']], [found.pk]
+        )
+
+
+class RecipeCursorTest(TestCase):
+
+    def test_cursor_with_search(self):
+        """Порядок поиска по релевантности не выражается ключом курсора"""
+
+        response = APIClient().get(
+            '/api/recipes/', {'search': 'суп', 'cursor': ''}
+        )
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('cursor', response.data)
+
+    def test_tampered_cursor(self):
+        """Подделанный курсор — 404, а не ошибка сервера"""
+
+        for data in (
+            {'p': [{}, 1], 'r': False},
+            {'p': ['вчера', 'один'], 'r': False},
+            {'p': ['2023-01-01T00:00:00+00:00', '1'], 'r': 'да'},
+            {'p': ['2023-01-01T00:00:00+00:00'], 'r': False},
+            [],
+        ):
+            with self.subTest(cursor=data):
+                cursor = base64.urlsafe_b64encode(
+                    json.dumps(data).encode()
+                ).decode()
+                response = APIClient().get(
+                    '/api/recipes/', {'cursor': cursor}
+                )
+                self.assertEqual(response.status_code, 404)
+
+
+class EstimatedPaginatorTest(SimpleTestCase):
+
+    def test_pages_do_not_depend_on_estimate(self):
+        """Заниженная оценка не прячет страницы, завышенная
+            не даёт ссылок на пустые"""
+
+        for estimate in (5, 1000):
+            with self.subTest(estimate=estimate):
+                paginator = EstimatedPaginator(
+                    list(range(25)), 10, count=estimate
+                )
+                self.assertTrue(paginator.page(2).has_next())
+                last = paginator.page(3)
+                self.assertEqual(list(last), list(range(20, 25)))
+                self.assertFalse(last.has_next())
+                self.assertEqual(paginator.count, estimate)
+                with self.assertRaises(EmptyPage):
+                    paginator.page(4)
+
+
+class Base64ImageFieldTest(SimpleTestCase):
+    """base64 с переносами строк, как его выдают MIME-кодировщики,
+        декодируется в исходные байты. Картинка больше одной части
+        декодирования, поэтому переносы попадают на границы частей"""
+
+    def test_wrapped_payload(self):
+
+        buffer = io.BytesIO()
+        Image.frombytes('L', (300, 300), os.urandom(300 * 300)).save(
+            buffer, 'PNG'
+        )
+        content = buffer.getvalue()
+        encoded = base64.encodebytes(content).decode()
+        for line_break in ('\n', '\r\n'):
+            with self.subTest(line_break=repr(line_break)):
+                file = Base64ImageField().to_internal_value(
+                    'data:image/png;base64,'
+                    + encoded.replace('\n', line_break)
+                )
+                file.seek(0)
+                self.assertEqual(file.read(), content)
@@ -37,6 +37,7 @@ router.register(
 
 
 urlpatterns = [
+    path('metrics/', views.metrics, name='metrics'),
     path('', include(router.urls)),
     path(r'auth/', include('djoser.urls')),
     path(r'auth/', include('djoser.urls.authtoken')),
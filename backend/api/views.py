@@ -1,18 +1,28 @@
+from collections import defaultdict
+
 from django.contrib.auth import get_user_model
-from django.http.response import HttpResponse
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+from django.http.response import HttpResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
 from django_filters.rest_framework import DjangoFilterBackend
 from djoser.views import UserViewSet as DjoserUserViewSet
-from recipes.models import (Favourites, Ingredient, RecipeIngredientsAmount,
-                            Recipes, ShoppingList, Tag)
+from foodgram.constants import INGREDIENT_SEARCH_LIMIT
+from recipes.models import (DataVersion, Favourites, Ingredient, Recipes,
+                            ShoppingCartIngredient, ShoppingList, Tag)
+from recipes.search import ingredient_index
 from rest_framework import pagination, status, viewsets
 from rest_framework.decorators import action
-from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.exceptions import ValidationError
+from rest_framework.permissions import AllowAny, IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
 from users.models import Subscription
 
+from .cache import recipe_representations
+from .exporters import SHOPPING_LIST_FORMATS
 from .filters import IngredientFilter, RecipesFilter
-from .mixins import RetrieveMixinViewSet
+from .metrics import request_metrics
+from .mixins import ConditionalGetMixin, RetrieveMixinViewSet
 from .pagination import MyCustomPagination
 from .permissions import AuthorOrReadOnly
 from .serializers import (FaouriteSerializer, IngridientSerializer,
@@ -22,6 +32,8 @@ from .serializers import (FaouriteSerializer, IngridientSerializer,
 
 User = get_user_model()
 
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
 
 class UserViewSet(DjoserUserViewSet):
     """Реализация модели User"""
@@ -29,6 +41,25 @@ class UserViewSet(DjoserUserViewSet):
     serializer_class = UsersListSerializer
     permission_classes = (AllowAny,)
     pagination_class = pagination.LimitOffsetPagination
+    cursor_ordering = ('-id',)
+    count_versioned_models = (User, Subscription)
+    count_per_user = True
+
+    def get_queryset(self):
+
+        queryset = super().get_queryset()
+        if self.request.user.is_anonymous:
+
+            return queryset
+
+        return queryset.annotate(
+            is_subscribed=Exists(
+                Subscription.objects.filter(
+                    user=self.request.user,
+                    author=OuterRef('pk')
+                )
+            )
+        )
 
     @action(detail=True,
             methods=['POST', 'DELETE'],
@@ -62,11 +93,23 @@ class UserViewSet(DjoserUserViewSet):
 
             return Response(status=status.HTTP_401_UNAUTHORIZED)
 
+        recipes_limit = SubscriptionsSerializer.parse_recipes_limit(request)
         pages = self.paginate_queryset(
-            User.objects.filter(blogger__user=self.request.user)
+            self.get_queryset().filter(blogger__user=self.request.user)
+        )
+        recipes_by_author = defaultdict(list)
+        if recipes_limit:
+            for recipe in Recipes.objects.latest_for_authors(
+                [author.id for author in pages], recipes_limit
+            ):
+                recipes_by_author[recipe.author_id].append(recipe)
+        serializer = SubscriptionsSerializer(
+            pages, many=True,
+            context={
+                'request': request,
+                'recipes_by_author': recipes_by_author,
+            }
         )
-        serializer = SubscriptionsSerializer(pages, many=True,
-                                             context={'request': request})
 
         return self.get_paginated_response(serializer.data)
 
@@ -77,6 +120,28 @@ class IngredientViewSet(RetrieveMixinViewSet):
     queryset = Ingredient.objects.all()
     serializer_class = IngridientSerializer
     filterset_class = IngredientFilter
+    versioned_models = (Ingredient,)
+
+    def list(self, request, *args, **kwargs):
+
+        if not request.query_params.get('name'):
+
+            return super().list(request, *args, **kwargs)
+
+        return self.conditional_response(self.search, request)
+
+    def search(self, request):
+
+        name = request.query_params['name']
+        if request.query_params.get('mode') == 'ranked':
+
+            return Response(
+                ingredient_index.ranked_search(name, INGREDIENT_SEARCH_LIMIT)
+            )
+
+        return Response(
+            ingredient_index.search(name, INGREDIENT_SEARCH_LIMIT)
+        )
 
 
 class TagViewSet(RetrieveMixinViewSet):
@@ -84,9 +149,10 @@ class TagViewSet(RetrieveMixinViewSet):
 
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
+    versioned_models = (Tag,)
 
 
-class RecipesViewSet(viewsets.ModelViewSet):
+class RecipesViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
     """Реализация операций модели Recipes"""
 
     queryset = Recipes.objects.all()
@@ -94,6 +160,58 @@ class RecipesViewSet(viewsets.ModelViewSet):
     permission_classes = (AuthorOrReadOnly,)
     filter_backends = (DjangoFilterBackend,)
     filterset_class = RecipesFilter
+    cursor_ordering = ('-pub_date', '-id')
+    cursor_excluded_params = ('search',)
+    count_versioned_models = (Recipes,)
+    count_filter_versioned_models = {
+        'is_favorited': (Favourites,),
+        'is_in_shopping_cart': (ShoppingList,),
+    }
+    count_user_params = ('is_favorited', 'is_in_shopping_cart')
+    user_versioned_models = (Favourites, ShoppingList, Subscription)
+
+    def get_validators(self):
+        """Рецепт меняется вместе с датой изменения, а отметки
+            пользователя — с версиями избранного, покупок и подписок"""
+
+        if self.action != 'retrieve':
+
+            return None
+
+        try:
+            modified = (
+                Recipes.objects
+                .filter(pk=self.kwargs['pk'])
+                .values_list('modified', flat=True)
+                .first()
+            )
+        except ValueError:
+
+            return None
+
+        if modified is None:
+
+            return None
+
+        parts, times = [f'recipe:{self.kwargs["pk"]}:{modified}'], [modified]
+        if self.request.user.is_authenticated:
+            versions = DataVersion.objects.get_many([
+                model._meta.label_lower
+                for model in self.user_versioned_models
+            ])
+            for name, (version, version_modified) in versions.items():
+                parts.append(f'{name}:{version}')
+                times.append(version_modified)
+
+        return parts, times
+
+    def get_queryset(self):
+
+        return (
+            Recipes.objects
+            .select_related('author')
+            .with_user_flags(self.request.user)
+        )
 
     def get_serializer_class(self):
 
@@ -152,19 +270,40 @@ class RecipesViewSet(viewsets.ModelViewSet):
 
         if request.method == 'POST':
 
-            ShoppingList.objects.create(user=self.request.user, recipe=recipe)
+            with transaction.atomic():
+                ShoppingList.objects.create(
+                    user=self.request.user,
+                    recipe=recipe
+                )
 
             return Response(serializer.data, status=status.HTTP_201_CREATED)
 
         if request.method == 'DELETE':
 
-            ShoppingList.objects.filter(
-                user=request.user,
-                recipe=recipe
-            ).delete()
+            with transaction.atomic():
+                ShoppingList.objects.filter(
+                    user=request.user,
+                    recipe=recipe
+                ).delete()
 
         return Response(status=status.HTTP_204_NO_CONTENT)
 
+    @action(
+        detail=False,
+        methods=['GET'],
+        permission_classes=(IsAdminUser,)
+    )
+    def cache_stats(self, request):
+
+        return Response(recipe_representations.stats())
+
+    def perform_content_negotiation(self, request, force=False):
+
+        if self.action == 'download_shopping_cart':
+            force = True
+
+        return super().perform_content_negotiation(request, force)
+
     @action(
         detail=False,
         methods=['GET'],
@@ -172,31 +311,38 @@ class RecipesViewSet(viewsets.ModelViewSet):
     )
     def download_shopping_cart(self, request):
 
+        file_format = request.query_params.get('format', 'txt')
+        if file_format not in SHOPPING_LIST_FORMATS:
+            raise ValidationError(
+                {'format': 'Доступные форматы: {}'.format(
+                    ', '.join(SHOPPING_LIST_FORMATS)
+                )}
+            )
+        render, content_type = SHOPPING_LIST_FORMATS[file_format]
         ingredients = (
-            RecipeIngredientsAmount.objects
-            .filter(recipes__shopping_list__user=request.user)
-            .order_by('ingredient__name')
+            ShoppingCartIngredient.objects
+            .filter(user=request.user)
+            .order_by('ingredient__name', 'ingredient__measurement_unit')
             .values_list(
                 'ingredient__name',
                 'amount',
                 'ingredient__measurement_unit'
             )
         )
+        response = StreamingHttpResponse(
+            render(ingredients.iterator()),
+            content_type=content_type
+        )
+        response['Content-Disposition'] = (
+            f'attachment; filename="shopping-list.{file_format}"'
+        )
 
-        filename = 'Список покупок: \n\n'
-        file_list = {}
-
-        for name, amount, unit in ingredients:
-
-            if name not in file_list:
-                file_list[name] = {'amount': amount, 'unit': unit}
-            else:
-                file_list[name]['amount'] += amount
+        return response
 
-        for ingredient in file_list:
 
-            filename += ingredient + ' - ' + str(
-                file_list[ingredient]['amount']
-            ) + ' ' + file_list[ingredient]['unit'] + '.\n'
+def metrics(request):
+    """Метрики текущего процесса в текстовом формате Prometheus"""
 
-        return HttpResponse(filename, content_type='text/plain')
+    return HttpResponse(
+        request_metrics.exposition(), content_type=PROMETHEUS_CONTENT_TYPE
+    )
@@ -1,2 +1,12 @@
 MINIMUM_COOCING_TIME_IN_MINUTES = 1
 MINIMUM_RECIPE_INGREDIENTS_AMOUNT = 1
+MAXIMUM_SUBSCRIPTION_RECIPES_LIMIT = 50
+INGREDIENT_SEARCH_LIMIT = 20
+CONDITIONAL_GET_MAX_AGE = 60
+RECIPE_CACHE_TIMEOUT = 60 * 60 * 24
+MAXIMUM_PAGE_SIZE = 100
+COUNT_CACHE_TIMEOUT = 30
+COUNT_ESTIMATE_THRESHOLD = 10000
+MAXIMUM_IMAGE_SIZE = 10 * 1024 * 1024
+MAXIMUM_IMAGE_DIMENSION = 8000
+ALLOWED_IMAGE_FORMATS = ('JPEG', 'PNG', 'WEBP', 'GIF')
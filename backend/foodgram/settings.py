@@ -36,7 +36,8 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
-    'drf_api_logger.middleware.api_logger_middleware.APILoggerMiddleware',
+    'api.middleware.APILogMiddleware',
+    'api.middleware.MetricsMiddleware',
 ]
 
 ROOT_URLCONF = 'foodgram.urls'
@@ -79,6 +80,28 @@ else:
         },
     }
 
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND',
+            default='django.core.cache.backends.locmem.LocMemCache'
+        ),
+        'LOCATION': os.getenv('CACHE_LOCATION', default='foodgram'),
+    },
+    'recipes': {
+        'BACKEND': os.getenv(
+            'RECIPE_CACHE_BACKEND',
+            default='django.core.cache.backends.locmem.LocMemCache'
+        ),
+        'LOCATION': os.getenv('RECIPE_CACHE_LOCATION', default='recipes'),
+        'OPTIONS': {
+            'MAX_ENTRIES': int(
+                os.getenv('RECIPE_CACHE_MAX_ENTRIES', default=5000)
+            ),
+        },
+    },
+}
+
 
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -142,6 +165,21 @@ DJOSER = {
     'LOGIN_FIELD': 'email',
 }
 
-DRF_API_LOGGER_DATABASE = True
+API_LOG = {
+    'ENABLED': os.getenv('API_LOG_ENABLED', default='True') == 'True',
+    'QUEUE_SIZE': int(os.getenv('API_LOG_QUEUE_SIZE', default=10000)),
+    'BATCH_SIZE': int(os.getenv('API_LOG_BATCH_SIZE', default=200)),
+    'FLUSH_INTERVAL': float(os.getenv('API_LOG_FLUSH_INTERVAL', default=2)),
+    'BODY_LIMIT': int(os.getenv('API_LOG_BODY_LIMIT', default=64 * 1024)),
+    'VALUE_LIMIT': 256,
+    'SAMPLE_RATE': float(os.getenv('API_LOG_SAMPLE_RATE', default=1)),
+    'SAMPLE_RATES': {
+        'ingredients-list': 0.1,
+        'tags-list': 0.1,
+        'metrics': 0,
+    },
+}
+
+DRF_API_LOGGER_DATABASE = API_LOG['ENABLED']
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
@@ -3,7 +3,7 @@ from django.contrib.auth.models import Group
 from django.db.models import Sum
 
 from .models import (Favourites, Ingredient, RecipeIngredientsAmount, Recipes,
-                     ShoppingList, Tag)
+                     ShoppingCartIngredient, ShoppingList, Tag)
 
 admin.site.site_header = 'Управление сайтом Foodgram'
 admin.site.site_title = 'Администратор сайта'
@@ -65,7 +65,7 @@ class RecipesAdmin(admin.ModelAdmin):
         'text',
         'cooking_time',
         'list_ingredients',
-        'count'
+        'favourites_count'
     )
     list_editable = (
         'author',
@@ -81,11 +81,6 @@ class RecipesAdmin(admin.ModelAdmin):
         'tags'
     )
 
-    def count(self, obj):
-
-        return Favourites.objects.filter(recipe=obj).count()
-    count.short_description = 'В избранном'
-
     def list_ingredients(self, obj):
 
         ingredients = (
@@ -108,6 +103,17 @@ class RecipesAdmin(admin.ModelAdmin):
 
     list_ingredients.short_description = 'Ингредиенты'
 
+    def save_related(self, request, form, formsets, change):
+        """Правка ингредиентов во вставке переносится в сводные
+            списки покупок пользователей, как и правка через API"""
+
+        amounts = RecipeIngredientsAmount.objects.filter(recipes=form.instance)
+        old_amounts = amounts.amounts_by_ingredient() if change else {}
+        super().save_related(request, form, formsets, change)
+        ShoppingCartIngredient.objects.change_recipe(
+            form.instance, old_amounts, amounts.amounts_by_ingredient()
+        )
+
 
 @admin.register(Favourites)
 class FavouritesAdmin(admin.ModelAdmin):
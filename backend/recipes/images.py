@@ -0,0 +1,134 @@
+import base64
+import io
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+from PIL import Image, ImageFilter, ImageOps
+
+from .models import RecipeImage, Recipes
+
+logger = logging.getLogger(__name__)
+
+VARIANT_WIDTHS = (320, 640, 1280)
+VARIANT_FORMAT = 'WEBP'
+VARIANT_EXTENSION = 'webp'
+VARIANT_QUALITY = 80
+VARIANTS_DIRECTORY = 'recipes/variants'
+PLACEHOLDER_WIDTH = 16
+PLACEHOLDER_BLUR_RADIUS = 1
+PLACEHOLDER_QUALITY = 30
+PLACEHOLDER_KEY = 'placeholder'
+IMAGE_WORKERS = int(os.getenv('RECIPE_IMAGE_WORKERS', default=2))
+
+executor = ThreadPoolExecutor(
+    max_workers=IMAGE_WORKERS, thread_name_prefix='recipe-images'
+)
+
+
+def encode(image, quality):
+
+    buffer = io.BytesIO()
+    image.save(buffer, VARIANT_FORMAT, quality=quality, method=4)
+
+    return buffer.getvalue()
+
+
+def resized(image, width):
+
+    height = max(1, round(image.height * width / image.width))
+
+    return image.resize((width, height), Image.LANCZOS)
+
+
+def variant_stem(name):
+    """Основа имён вариантов: точки имени файла заменены дефисами,
+        чтобы temp.png и temp.jpeg не делили одни варианты"""
+
+    return os.path.basename(name).replace('.', '-')
+
+
+def build_variants(name):
+    """Уменьшенные копии картинки name в WebP и размытая заглушка
+        в виде data URI. Ширины больше исходной не создаются,
+        кроме наименьшей"""
+
+    with default_storage.open(name, 'rb') as file:
+        image = ImageOps.exif_transpose(Image.open(file))
+        image = image.convert('RGBA' if 'A' in image.getbands() else 'RGB')
+
+    stem = variant_stem(name)
+    variants = {}
+    for width in VARIANT_WIDTHS:
+        if width > image.width and variants:
+            break
+        path = f'{VARIANTS_DIRECTORY}/{stem}-{width}.{VARIANT_EXTENSION}'
+        if default_storage.exists(path):
+            default_storage.delete(path)
+        variants[str(width)] = default_storage.save(
+            path,
+            ContentFile(encode(
+                resized(image, min(width, image.width)), VARIANT_QUALITY
+            ))
+        )
+
+    placeholder = resized(image, PLACEHOLDER_WIDTH).filter(
+        ImageFilter.GaussianBlur(PLACEHOLDER_BLUR_RADIUS)
+    )
+    variants[PLACEHOLDER_KEY] = 'data:image/{};base64,{}'.format(
+        VARIANT_EXTENSION,
+        base64.b64encode(encode(placeholder, PLACEHOLDER_QUALITY)).decode()
+    )
+
+    return variants
+
+
+def process_recipe_image(recipe_id, name):
+    """Сохраняет варианты картинки, если она не сменилась за время
+        обработки. update() не отправляет сигналы, поэтому дата
+        изменения рецепта обновляется явно"""
+
+    try:
+        variants = build_variants(name)
+        Recipes.objects.filter(pk=recipe_id, image=name).update(
+            images=variants, modified=timezone.now()
+        )
+    except Exception:
+        logger.exception('Не удалось обработать картинку %s', name)
+    finally:
+        close_old_connections()
+
+
+def schedule_recipe_image(recipe):
+    """Обработка картинки в пуле потоков после фиксации транзакции"""
+
+    recipe_id, name = recipe.pk, recipe.image.name
+    transaction.on_commit(
+        lambda: executor.submit(process_recipe_image, recipe_id, name)
+    )
+
+
+def delete_image_files(name, variants):
+    """Удаляет файл картинки и её варианты, если за это время
+        на картинку снова не сослался новый рецепт"""
+
+    if RecipeImage.objects.filter(name=name).exists():
+
+        return
+
+    Recipes._meta.get_field('image').storage.delete(name)
+    for key, variant in (variants or {}).items():
+        if key != PLACEHOLDER_KEY:
+            default_storage.delete(variant)
+
+
+def release_recipe_image(name, variants):
+    """Файлы удаляются после фиксации транзакции, когда на картинку
+        не ссылается ни один рецепт"""
+
+    if RecipeImage.objects.release(name):
+        transaction.on_commit(lambda: delete_image_files(name, variants))
@@ -0,0 +1,538 @@
+import base64
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import tempfile
+import time
+
+import django
+from api.logs import api_log_writer
+from django.contrib.auth.hashers import make_password
+from django.core.cache import caches
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.test.utils import override_settings
+from PIL import Image
+from recipes.images import executor
+from recipes.models import (Favourites, Ingredient, RecipeImage,
+                            RecipeIngredientsAmount, Recipes, ShoppingList,
+                            Tag)
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+from users.models import Subscription, User
+
+DATASET = {
+    'users': 200,
+    'recipes': 2000,
+    'ingredients': 2000,
+    'tags': 6,
+    'recipe_ingredients': 6,
+    'favourites': 20,
+    'cart': 5,
+    'subscriptions': 10,
+}
+REQUESTS = 200
+WARMUP = 20
+TOLERANCE = 0.2
+PAGE_SIZE = 6
+BATCH_SIZE = 1000
+MEASUREMENT_UNITS = ('г', 'кг', 'мл', 'л', 'шт', 'ст. л.')
+WORDS = (
+    'суп', 'борщ', 'каша', 'пирог', 'салат', 'рагу', 'плов', 'котлеты',
+    'блины', 'запеканка', 'томатный', 'куриный', 'овощной', 'грибной',
+    'сырный', 'морковь', 'картофель', 'лук', 'чеснок', 'яблоко',
+)
+SCENARIOS = (
+    'feed',
+    'feed_filtered',
+    'recipe_detail',
+    'subscriptions',
+    'ingredient_search',
+    'download_shopping_cart',
+    'recipe_create',
+    'recipe_update',
+)
+
+
+def percentile(values, fraction):
+    """Перцентиль отсортированного списка с линейной интерполяцией"""
+
+    position = (len(values) - 1) * fraction
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+
+    return values[lower] + (values[upper] - values[lower]) * (
+        position - lower
+    )
+
+
+def png_data_uri(color):
+
+    buffer = io.BytesIO()
+    Image.new('RGB', (64, 48), color).save(buffer, 'PNG')
+
+    return 'data:image/png;base64,' + base64.b64encode(
+        buffer.getvalue()
+    ).decode()
+
+
+class QueryCounter:
+    """Число SQL-запросов основного потока через execute_wrapper"""
+
+    def __init__(self):
+        self.queries = 0
+
+    def __call__(self, execute, sql, params, many, context):
+
+        self.queries += 1
+
+        return execute(sql, params, many, context)
+
+
+class Command(BaseCommand):
+    help = (
+        'Нагрузочный тест API: заполняет тестовую базу, выполняет '
+        'запросы к основным эндпоинтам в процессе и выводит '
+        'перцентили задержки, пропускную способность и число запросов '
+        'к базе в JSON, сравнивая с сохранённым эталоном'
+    )
+
+    def add_arguments(self, parser):
+        for name, default in DATASET.items():
+            parser.add_argument(
+                f'--{name.replace("_", "-")}',
+                type=int,
+                default=default,
+                help=f'Размер набора данных: {name}',
+            )
+        parser.add_argument('--requests', type=int, default=REQUESTS)
+        parser.add_argument('--warmup', type=int, default=WARMUP)
+        parser.add_argument(
+            '--seed', type=int, default=0,
+            help='Зерно генератора: одинаковые данные и запросы; '
+                 'у каждого сценария свой генератор и пустой кэш',
+        )
+        parser.add_argument(
+            '--scenario',
+            action='append',
+            choices=SCENARIOS,
+            help='Запустить только указанные сценарии',
+        )
+        parser.add_argument('--output', help='Сохранить результат в JSON')
+        parser.add_argument('--baseline', help='JSON эталонного прогона')
+        parser.add_argument(
+            '--tolerance',
+            type=float,
+            default=TOLERANCE,
+            help='Допустимый рост p95 относительно эталона',
+        )
+        parser.add_argument(
+            '--fail-on-regression',
+            action='store_true',
+            help='Завершиться с ошибкой при регрессии',
+        )
+
+    def handle(self, *args, **options):
+
+        if options['requests'] < 1:
+            raise CommandError('Число запросов должно быть положительным')
+
+        baseline = None
+        if options['baseline']:
+            with open(options['baseline'], encoding='utf-8') as file:
+                baseline = json.load(file)
+
+        self.seed_value = options['seed']
+        self.random = random.Random(self.seed_value)
+        self.dataset = {name: options[name] for name in DATASET}
+        media_root = tempfile.mkdtemp(prefix='foodgram-benchmark-')
+        old_name = connection.settings_dict['NAME']
+        self.create_database(media_root)
+        try:
+            with override_settings(DEBUG=False, MEDIA_ROOT=media_root):
+                self.seed()
+                scenarios = self.run_scenarios(
+                    options['scenario'] or SCENARIOS,
+                    options['requests'],
+                    options['warmup']
+                )
+        finally:
+            executor.shutdown(wait=True)
+            api_log_writer.flush()
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            shutil.rmtree(media_root, ignore_errors=True)
+
+        result = {
+            'environment': {
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'database': connection.vendor,
+            },
+            'dataset': self.dataset,
+            'seed': options['seed'],
+            'requests': options['requests'],
+            'scenarios': scenarios,
+        }
+        regressions = []
+        if baseline is not None:
+            result['comparison'], regressions = self.compare(
+                scenarios, baseline.get('scenarios', {}),
+                options['tolerance']
+            )
+
+        output = json.dumps(result, indent=2, ensure_ascii=False)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                file.write(output + '\n')
+        self.stdout.write(output)
+
+        for line in regressions:
+            self.stderr.write(self.style.ERROR(line))
+        if regressions and options['fail_on_regression']:
+            raise CommandError(f'Регрессий: {len(regressions)}')
+
+    @staticmethod
+    def create_database(media_root):
+        """Отдельная тестовая база. SQLite — в файле, а не в памяти:
+            фоновые потоки журнала и картинок пишут в неё
+            параллельно с запросами"""
+
+        test_settings = connection.settings_dict.setdefault('TEST', {})
+        if connection.vendor == 'sqlite' and not test_settings.get('NAME'):
+            test_settings['NAME'] = os.path.join(media_root, 'benchmark.db')
+
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+
+    def seed(self):
+        """Набор данных с явными первичными ключами: bulk_create
+            в SQLite не возвращает id. Сигналы не отправляются,
+            поэтому счётчики, списки покупок и поисковый индекс
+            пересчитываются командами, а последовательности id —
+            сбрасываются"""
+
+        started = time.monotonic()
+        size = self.dataset
+        image = Recipes._meta.get_field('image').storage.save(
+            'recipes/benchmark.png',
+            ContentFile(base64.b64decode(
+                png_data_uri((200, 120, 40)).split(',', 1)[1]
+            ))
+        )
+        password = make_password('benchmark-password')
+
+        with transaction.atomic():
+            tags = Tag.objects.bulk_create(
+                Tag(
+                    id=pk, name=f'Тег {pk}', slug=f'tag-{pk}',
+                    color='#{:06X}'.format(self.random.randrange(1 << 24))
+                )
+                for pk in range(1, size['tags'] + 1)
+            )
+            Ingredient.objects.bulk_create(
+                (
+                    Ingredient(
+                        id=pk,
+                        name=f'{self.random.choice(WORDS)} {pk}',
+                        measurement_unit=self.random.choice(
+                            MEASUREMENT_UNITS
+                        )
+                    )
+                    for pk in range(1, size['ingredients'] + 1)
+                ),
+                batch_size=BATCH_SIZE
+            )
+            User.objects.bulk_create(
+                (
+                    User(
+                        id=pk, username=f'user{pk}',
+                        email=f'user{pk}@benchmark.local',
+                        first_name='Имя', last_name='Фамилия',
+                        password=password
+                    )
+                    for pk in range(1, size['users'] + 1)
+                ),
+                batch_size=BATCH_SIZE
+            )
+            Recipes.objects.bulk_create(
+                (
+                    Recipes(
+                        id=pk,
+                        author_id=self.random.randint(1, size['users']),
+                        name=' '.join(self.random.sample(WORDS, 3)),
+                        text=' '.join(self.random.choices(WORDS, k=30)),
+                        image=image,
+                        cooking_time=self.random.randint(1, 120)
+                    )
+                    for pk in range(1, size['recipes'] + 1)
+                ),
+                batch_size=BATCH_SIZE
+            )
+            RecipeImage.objects.acquire(image, size['recipes'])
+            self.seed_relations(tags)
+            self.reset_sequences()
+
+        call_command('rebuild_counters', stdout=io.StringIO())
+        call_command('rebuild_search_index', stdout=io.StringIO())
+
+        self.user = User.objects.get(pk=1)
+        self.token = Token.objects.create(user=self.user).key
+        self.stderr.write(
+            f'Данные подготовлены за {time.monotonic() - started:.1f} с'
+        )
+
+    def seed_relations(self, tags):
+
+        size = self.dataset
+        recipe_ids = range(1, size['recipes'] + 1)
+        Recipes.tags.through.objects.bulk_create(
+            (
+                Recipes.tags.through(recipes_id=recipe_id, tag_id=tag.id)
+                for recipe_id in recipe_ids
+                for tag in self.random.sample(tags, min(2, len(tags)))
+            ),
+            batch_size=BATCH_SIZE
+        )
+        RecipeIngredientsAmount.objects.bulk_create(
+            (
+                RecipeIngredientsAmount(
+                    recipes_id=recipe_id,
+                    ingredient_id=ingredient_id,
+                    amount=self.random.randint(1, 500)
+                )
+                for recipe_id in recipe_ids
+                for ingredient_id in self.random.sample(
+                    range(1, size['ingredients'] + 1),
+                    min(size['recipe_ingredients'], size['ingredients'])
+                )
+            ),
+            batch_size=BATCH_SIZE
+        )
+        for model, per_user in (
+            (Favourites, size['favourites']),
+            (ShoppingList, size['cart']),
+        ):
+            model.objects.bulk_create(
+                (
+                    model(user_id=user_id, recipe_id=recipe_id)
+                    for user_id in range(1, size['users'] + 1)
+                    for recipe_id in self.random.sample(
+                        recipe_ids, min(per_user, size['recipes'])
+                    )
+                ),
+                batch_size=BATCH_SIZE
+            )
+        Subscription.objects.bulk_create(
+            (
+                Subscription(user_id=user_id, author_id=author_id)
+                for user_id in range(1, size['users'] + 1)
+                for author_id in self.random.sample(
+                    range(1, size['users'] + 1),
+                    min(size['subscriptions'] + 1, size['users'])
+                )
+                if author_id != user_id
+            ),
+            batch_size=BATCH_SIZE
+        )
+
+    @staticmethod
+    def reset_sequences():
+
+        statements = connection.ops.sequence_reset_sql(
+            no_style(), [Tag, Ingredient, User, Recipes]
+        )
+        with connection.cursor() as cursor:
+            for statement in statements:
+                cursor.execute(statement)
+
+    def run_scenarios(self, names, requests, warmup):
+
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Token {self.token}')
+        self.client = client
+        self.image = png_data_uri((40, 120, 200))
+        self.own_recipe = Recipes.objects.filter(author=self.user).first()
+        if self.own_recipe is None:
+            self.own_recipe = self.create_recipe()
+
+        results = {}
+        for name in names:
+            self.random = random.Random(f'{self.seed_value}:{name}')
+            for alias in caches:
+                caches[alias].clear()
+            request = getattr(self, f'request_{name}')
+            for _ in range(warmup):
+                self.perform(name, request)
+            results[name] = self.measure(name, request, requests)
+            self.stderr.write(
+                '{}: p50 {} мс, p95 {} мс'.format(
+                    name, results[name]['p50_ms'], results[name]['p95_ms']
+                )
+            )
+
+        return results
+
+    @staticmethod
+    def perform(name, request):
+        """Запрос с чтением потокового ответа: генератор тела
+            выполняется только при чтении, а вместе с ним — запросы
+            к базе и отрисовка файла. Ответ с ошибкой прерывает прогон"""
+
+        response = request()
+        if getattr(response, 'streaming', False):
+            b''.join(response.streaming_content)
+        if response.status_code >= 400:
+            raise CommandError(
+                f'{name}: ответ {response.status_code} '
+                f'{getattr(response, "data", "")}'
+            )
+
+        return response
+
+    def measure(self, name, request, requests):
+
+        counter = QueryCounter()
+        latencies = []
+        with connection.execute_wrapper(counter):
+            started = time.perf_counter()
+            for _ in range(requests):
+                request_started = time.perf_counter()
+                self.perform(name, request)
+                latencies.append(time.perf_counter() - request_started)
+            elapsed = time.perf_counter() - started
+
+        latencies.sort()
+
+        return {
+            'requests': requests,
+            'p50_ms': round(percentile(latencies, 0.5) * 1000, 3),
+            'p95_ms': round(percentile(latencies, 0.95) * 1000, 3),
+            'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+            'mean_ms': round(sum(latencies) / requests * 1000, 3),
+            'throughput_rps': round(requests / elapsed, 1),
+            'queries_per_request': round(counter.queries / requests, 2),
+        }
+
+    def recipe_payload(self):
+
+        return {
+            'tags': [self.random.randint(1, self.dataset['tags'])],
+            'ingredients': [
+                {'id': ingredient_id, 'amount': self.random.randint(1, 500)}
+                for ingredient_id in self.random.sample(
+                    range(1, self.dataset['ingredients'] + 1),
+                    min(3, self.dataset['ingredients'])
+                )
+            ],
+            'name': ' '.join(self.random.sample(WORDS, 3)),
+            'text': ' '.join(self.random.choices(WORDS, k=30)),
+            'cooking_time': self.random.randint(1, 120),
+            'image': self.image,
+        }
+
+    def create_recipe(self):
+
+        response = self.client.post(
+            '/api/recipes/', self.recipe_payload(), format='json'
+        )
+        if response.status_code != 201:
+            raise CommandError(f'Не удалось создать рецепт: {response.data}')
+
+        return Recipes.objects.get(pk=response.data['id'])
+
+    def request_feed(self):
+
+        pages = max(1, self.dataset['recipes'] // PAGE_SIZE)
+
+        return self.client.get('/api/recipes/', {
+            'page': self.random.randint(1, min(pages, 50)),
+            'limit': PAGE_SIZE,
+        })
+
+    def request_feed_filtered(self):
+
+        return self.client.get('/api/recipes/', {
+            'tags': f'tag-{self.random.randint(1, self.dataset["tags"])}',
+            'is_favorited': self.random.choice((0, 1)),
+            'limit': PAGE_SIZE,
+        })
+
+    def request_recipe_detail(self):
+
+        return self.client.get(
+            f'/api/recipes/{self.random.randint(1, self.dataset["recipes"])}/'
+        )
+
+    def request_subscriptions(self):
+
+        return self.client.get(
+            '/api/users/subscriptions/', {'recipes_limit': 3}
+        )
+
+    def request_ingredient_search(self):
+
+        return self.client.get(
+            '/api/ingredients/', {'name': self.random.choice(WORDS)[:3]}
+        )
+
+    def request_download_shopping_cart(self):
+
+        return self.client.get('/api/recipes/download_shopping_cart/')
+
+    def request_recipe_create(self):
+
+        return self.client.post(
+            '/api/recipes/', self.recipe_payload(), format='json'
+        )
+
+    def request_recipe_update(self):
+
+        return self.client.patch(
+            f'/api/recipes/{self.own_recipe.pk}/',
+            self.recipe_payload(),
+            format='json'
+        )
+
+    @staticmethod
+    def compare(scenarios, baseline, tolerance):
+        """Изменения p95 и числа запросов относительно эталона
+            и список регрессий"""
+
+        comparison = {}
+        regressions = []
+        for name, current in scenarios.items():
+            previous = baseline.get(name)
+            if previous is None:
+
+                continue
+
+            p95_change = (
+                current['p95_ms'] / previous['p95_ms'] - 1
+                if previous['p95_ms'] else 0
+            )
+            queries_change = (
+                current['queries_per_request']
+                - previous['queries_per_request']
+            )
+            comparison[name] = {
+                'p95_change': round(p95_change, 3),
+                'queries_change': round(queries_change, 2),
+            }
+            if p95_change > tolerance:
+                regressions.append(
+                    f'{name}: p95 {previous["p95_ms"]} → '
+                    f'{current["p95_ms"]} мс (+{p95_change:.0%})'
+                )
+            if queries_change > 0:
+                regressions.append(
+                    f'{name}: запросов к базе '
+                    f'{previous["queries_per_request"]} → '
+                    f'{current["queries_per_request"]}'
+                )
+
+        return comparison, regressions
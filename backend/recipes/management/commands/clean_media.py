@@ -0,0 +1,220 @@
+import os
+import re
+import shutil
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.functional import cached_property
+from recipes.images import VARIANT_EXTENSION, VARIANTS_DIRECTORY, variant_stem
+from recipes.models import RecipeImage, Recipes
+
+GRACE_HOURS = 24
+BATCH_SIZE = 1000
+IMAGE_FIELD = Recipes._meta.get_field('image')
+HASHED_STEM = re.compile(r'[0-9a-f]{64}-\w+')
+
+
+def walk_files(root):
+    """Файлы под root по одному: в памяти только стек каталогов"""
+
+    directories = [root]
+    while directories:
+        with os.scandir(directories.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    directories.append(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    yield entry
+
+
+def batches(items, size):
+
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def variant_source_stem(name):
+    """Основа имени исходной картинки из recipes/variants/<основа>-
+        <ширина>.webp или None для посторонних файлов"""
+
+    stem, _, extension = os.path.basename(name).rpartition('.')
+    stem, _, width = stem.rpartition('-')
+    if extension != VARIANT_EXTENSION or not stem or not width.isdigit():
+
+        return None
+
+    return stem
+
+
+def referenced_images(names):
+    """Имена из names, на которые ссылаются рецепты"""
+
+    return set(
+        Recipes.objects.filter(image__in=names)
+        .values_list('image', flat=True)
+        .iterator()
+    ) | set(
+        RecipeImage.objects.filter(name__in=names)
+        .values_list('name', flat=True)
+        .iterator()
+    )
+
+
+def referenced_stems(stems):
+    """Основы из stems с именем по хэшу, исходные картинки которых
+        ещё используются: имя картинки восстанавливается точно
+        и ищется по индексу. Остальные основы возвращаются вторым
+        значением для сверки с основами картинок рецептов"""
+
+    hashed, legacy = {}, set()
+    for stem in stems:
+        digest, _, extension = stem.rpartition('-')
+        if HASHED_STEM.fullmatch(stem):
+            hashed[
+                f'{IMAGE_FIELD.upload_to}{digest[:2]}/{digest}.{extension}'
+            ] = stem
+        else:
+            legacy.add(stem)
+
+    return {
+        hashed[name] for name in referenced_images(list(hashed))
+    }, legacy
+
+
+class Command(BaseCommand):
+    help = (
+        'Удаление файлов картинок рецептов и их вариантов, на которые '
+        'не ссылается ни один рецепт. Каталог обходится потоково, '
+        'ссылки проверяются пакетами'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--grace-hours',
+            type=float,
+            default=GRACE_HOURS,
+            help='Не трогать файлы моложе этого срока',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Только показать, что было бы удалено',
+        )
+        parser.add_argument(
+            '--quarantine',
+            help='Переносить файлы в этот каталог вместо удаления',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=BATCH_SIZE,
+            help='Файлов в одном запросе к базе',
+        )
+
+    def handle(self, *args, **options):
+
+        if options['batch_size'] < 1:
+            raise CommandError('Размер пакета должен быть положительным')
+
+        self.storage_root = os.path.realpath(IMAGE_FIELD.storage.location)
+        self.quarantine = options['quarantine'] and os.path.realpath(
+            options['quarantine']
+        )
+        self.dry_run = options['dry_run']
+        self.verbosity = options['verbosity']
+        self.deadline = time.time() - options['grace_hours'] * 3600
+        self.scanned = self.removed = self.reclaimed = 0
+
+        root = os.path.join(self.storage_root, IMAGE_FIELD.upload_to)
+        if not os.path.isdir(root):
+            raise CommandError(f'Каталог {root} не найден')
+        if self.quarantine and (self.quarantine + os.sep).startswith(root):
+            raise CommandError(f'Карантин должен быть вне каталога {root}')
+
+        for batch in batches(self.candidates(root), options['batch_size']):
+            self.collect(batch)
+
+        action = 'Было бы удалено' if self.dry_run else 'Удалено'
+        self.stdout.write(self.style.SUCCESS(
+            f'Просмотрено файлов: {self.scanned}, {action.lower()}: '
+            f'{self.removed}, освобождено байт: {self.reclaimed}'
+        ))
+
+    def candidates(self, root):
+        """(имя в хранилище, путь, размер) файлов старше срока ожидания"""
+
+        for entry in walk_files(root):
+            self.scanned += 1
+            stat = entry.stat(follow_symlinks=False)
+            if stat.st_mtime > self.deadline:
+
+                continue
+
+            name = os.path.relpath(entry.path, self.storage_root).replace(
+                os.sep, '/'
+            )
+            yield name, entry.path, stat.st_size
+
+    @cached_property
+    def image_stems(self):
+        """Основы вариантов всех картинок рецептов для файлов со старыми
+            именами: имена читаются потоком один раз за запуск, основа
+            получается как в variant_stem"""
+
+        return {
+            variant_stem(name) for name in
+            Recipes.objects.values_list('image', flat=True).iterator()
+        }
+
+    def collect(self, batch):
+
+        variants = VARIANTS_DIRECTORY + '/'
+        stems = {
+            name: variant_source_stem(name)
+            for name, _, _ in batch if name.startswith(variants)
+        }
+        images = referenced_images(
+            [name for name, _, _ in batch if name not in stems]
+        )
+        used_stems, legacy = referenced_stems(
+            {stem for stem in stems.values() if stem}
+        )
+        if legacy:
+            used_stems |= legacy & self.image_stems
+        for name, path, size in batch:
+            if name in images or name in stems and (
+                stems[name] is None or stems[name] in used_stems
+            ):
+
+                continue
+
+            if self.verbosity > 1 or self.dry_run:
+                self.stdout.write(name)
+            if not self.dry_run and not self.remove(name, path):
+
+                continue
+
+            self.removed += 1
+            self.reclaimed += size
+
+    def remove(self, name, path):
+
+        try:
+            if self.quarantine:
+                target = os.path.join(self.quarantine, name)
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                shutil.move(path, target)
+            else:
+                os.remove(path)
+        except OSError as error:
+            self.stderr.write(f'{name}: {error}')
+
+            return False
+
+        return True
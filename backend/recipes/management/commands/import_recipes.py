@@ -0,0 +1,342 @@
+import csv
+import json
+import time
+from collections import Counter
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError, connection, transaction
+from django.db.models import F
+from foodgram.constants import (MINIMUM_COOCING_TIME_IN_MINUTES,
+                                MINIMUM_RECIPE_INGREDIENTS_AMOUNT)
+from recipes.images import schedule_recipe_image
+from recipes.models import (DataVersion, Ingredient, RecipeImage,
+                            RecipeIngredientsAmount, Recipes, RecipeSearchTerm,
+                            Tag)
+from users.models import User
+
+BATCH_SIZE = 500
+LIST_SEPARATOR = '|'
+INGREDIENT_SEPARATOR = ':'
+NAME_MAX_LENGTH = Recipes._meta.get_field('name').max_length
+IMAGE_MAX_LENGTH = Recipes._meta.get_field('image').max_length
+
+
+class RecordError(ValueError):
+    """Ошибка в записи файла импорта"""
+
+
+def read_ndjson(file):
+    """Записи NDJSON: один JSON-объект на строку"""
+
+    for line in file:
+        if not line.strip():
+            yield None
+
+            continue
+
+        try:
+            yield json.loads(line)
+        except ValueError as error:
+            yield RecordError(f'некорректный JSON: {error}')
+
+
+def read_csv(file):
+    """Записи CSV с колонками author, name, text, cooking_time, image,
+        tags (слаги через «|») и ingredients («название:единица:
+        количество» через «|»)"""
+
+    yield None
+    for row in csv.DictReader(file):
+        try:
+            row['tags'] = [
+                slug for slug in row['tags'].split(LIST_SEPARATOR) if slug
+            ]
+            row['ingredients'] = [
+                dict(zip(
+                    ('name', 'measurement_unit', 'amount'),
+                    item.rsplit(INGREDIENT_SEPARATOR, 2)
+                ))
+                for item in row['ingredients'].split(LIST_SEPARATOR) if item
+            ]
+        except (AttributeError, KeyError) as error:
+            yield RecordError(f'нет колонки {error}')
+
+            continue
+
+        yield row
+
+
+READERS = {
+    'ndjson': read_ndjson,
+    'csv': read_csv,
+}
+
+
+class Command(BaseCommand):
+    help = (
+        'Импорт рецептов из NDJSON или CSV пакетами. Картинки указываются '
+        'путём относительно MEDIA_ROOT и должны быть загружены заранее'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Путь к файлу с рецептами')
+        parser.add_argument(
+            '--format',
+            choices=READERS,
+            help='Формат файла, по умолчанию — по расширению',
+        )
+        parser.add_argument(
+            '--author',
+            help='Имя пользователя для записей без автора',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=BATCH_SIZE,
+            help='Рецептов в одной транзакции',
+        )
+
+    def handle(self, *args, **options):
+
+        path = options['path']
+        file_format = options['format'] or path.rsplit('.', 1)[-1].lower()
+        if file_format == 'jsonl':
+            file_format = 'ndjson'
+        if file_format not in READERS:
+            raise CommandError(f'Неизвестный формат файла: {file_format}')
+        if options['batch_size'] < 1:
+            raise CommandError('Размер пакета должен быть положительным')
+
+        self.default_author = options['author']
+        self.tags = dict(Tag.objects.values_list('slug', 'id'))
+        self.ingredients = {
+            (name, measurement_unit): pk
+            for pk, name, measurement_unit in Ingredient.objects.values_list(
+                'id', 'name', 'measurement_unit'
+            ).iterator()
+        }
+        self.imported = 0
+        self.errors = 0
+        started = time.monotonic()
+
+        batch = []
+        with open(path, 'r', encoding='utf-8-sig', newline='') as file:
+            for line_number, record in enumerate(
+                READERS[file_format](file), start=1
+            ):
+                if record is None:
+
+                    continue
+
+                try:
+                    if isinstance(record, RecordError):
+                        raise record
+                    batch.append((line_number, self.parse(record)))
+                except RecordError as error:
+                    self.report_error(line_number, error)
+                if len(batch) == options['batch_size']:
+                    self.save_batch(batch, started)
+                    batch = []
+        self.save_batch(batch, started)
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Импортировано рецептов: {self.imported}, ошибок: '
+            f'{self.errors}, {self.imported / (elapsed or 1):.0f} строк/с'
+        ))
+
+    def report_error(self, line_number, error):
+
+        self.errors += 1
+        self.stderr.write(f'Строка {line_number}: {error}')
+
+    def parse(self, record):
+        """Проверенные данные рецепта: поля, id тегов и количества
+            ингредиентов по id"""
+
+        if not isinstance(record, dict):
+            raise RecordError('запись должна быть объектом')
+
+        author = record.get('author') or self.default_author
+        if not author:
+            raise RecordError('не указан автор')
+
+        return {
+            'recipe': self.parse_fields(record),
+            'author': author,
+            'tags': self.parse_tags(record.get('tags') or []),
+            'amounts': self.parse_amounts(record.get('ingredients') or []),
+        }
+
+    @staticmethod
+    def parse_fields(record):
+
+        name = str(record.get('name') or '').strip()
+        if not name or len(name) > NAME_MAX_LENGTH:
+            raise RecordError(
+                f'название должно быть от 1 до {NAME_MAX_LENGTH} символов'
+            )
+        text = str(record.get('text') or '').strip()
+        if not text:
+            raise RecordError('не указано описание')
+        image = str(record.get('image') or '').strip()
+        if not image:
+            raise RecordError('не указана картинка')
+        if len(image) > IMAGE_MAX_LENGTH:
+            raise RecordError(
+                f'путь к картинке длиннее {IMAGE_MAX_LENGTH} символов'
+            )
+        try:
+            cooking_time = int(record.get('cooking_time'))
+        except (TypeError, ValueError):
+            raise RecordError('время приготовления должно быть числом')
+        if cooking_time < MINIMUM_COOCING_TIME_IN_MINUTES:
+            raise RecordError('минимальное время приготовления 1 минута')
+
+        return {
+            'name': name,
+            'text': text,
+            'image': image,
+            'cooking_time': cooking_time,
+        }
+
+    def parse_tags(self, slugs):
+
+        if not isinstance(slugs, list):
+            raise RecordError('теги должны быть списком')
+        unknown = [slug for slug in slugs if slug not in self.tags]
+        if unknown:
+            raise RecordError(f'неизвестные теги: {", ".join(unknown)}')
+        if not slugs:
+            raise RecordError('должен быть указан хотя бы один тег')
+
+        return {self.tags[slug] for slug in slugs}
+
+    def parse_amounts(self, ingredients):
+        """Количества по id ингредиента; повторы складываются"""
+
+        if not isinstance(ingredients, list):
+            raise RecordError('ингредиенты должны быть списком')
+        amounts = Counter()
+        for item in ingredients:
+            if not isinstance(item, dict):
+                raise RecordError('ингредиент должен быть объектом')
+            key = (
+                str(item.get('name', '')).strip(),
+                str(item.get('measurement_unit', '')).strip()
+            )
+            if key not in self.ingredients:
+                raise RecordError(
+                    'неизвестный ингредиент: {}, {}'.format(*key)
+                )
+            try:
+                amount = int(item.get('amount'))
+            except (TypeError, ValueError):
+                raise RecordError(f'количество «{key[0]}» должно быть числом')
+            if amount < MINIMUM_RECIPE_INGREDIENTS_AMOUNT:
+                raise RecordError(f'количество «{key[0]}» меньше 1')
+            amounts[self.ingredients[key]] += amount
+        if not amounts:
+            raise RecordError('укажите хотя бы 1 ингредиент')
+
+        return amounts
+
+    def save_batch(self, batch, started):
+
+        if not batch:
+
+            return
+
+        authors = dict(
+            User.objects
+            .filter(username__in={data['author'] for _, data in batch})
+            .values_list('username', 'id')
+        )
+        rows = []
+        for line_number, data in batch:
+            if data['author'] not in authors:
+                self.report_error(
+                    line_number, f'неизвестный автор: {data["author"]}'
+                )
+
+                continue
+
+            rows.append((line_number, data))
+        if not rows:
+
+            return
+
+        try:
+            self.save_rows([data for _, data in rows], authors)
+        except DatabaseError as error:
+            self.errors += len(rows)
+            self.stderr.write(
+                'Строки {}-{}: пакет не сохранён: {}'.format(
+                    rows[0][0], rows[-1][0], error
+                )
+            )
+
+            return
+
+        self.imported += len(rows)
+        elapsed = time.monotonic() - started
+        self.stdout.write(
+            f'Импортировано рецептов: {self.imported}, '
+            f'{self.imported / (elapsed or 1):.0f} строк/с'
+        )
+
+    def save_rows(self, rows, authors):
+        """Рецепты пакета одной транзакцией: при ошибке базы
+            не сохраняется ни один"""
+
+        with transaction.atomic():
+            recipes = [
+                Recipes(author_id=authors[data['author']], **data['recipe'])
+                for data in rows
+            ]
+            if connection.features.can_return_rows_from_bulk_insert:
+                self.bulk_create_recipes(recipes)
+            else:
+                for recipe in recipes:
+                    recipe.save()
+
+            Recipes.tags.through.objects.bulk_create(
+                Recipes.tags.through(recipes_id=recipe.pk, tag_id=tag_id)
+                for recipe, data in zip(recipes, rows)
+                for tag_id in data['tags']
+            )
+            RecipeIngredientsAmount.objects.bulk_create(
+                RecipeIngredientsAmount(
+                    recipes_id=recipe.pk,
+                    ingredient_id=ingredient_id,
+                    amount=amount
+                )
+                for recipe, data in zip(recipes, rows)
+                for ingredient_id, amount in data['amounts'].items()
+            )
+            DataVersion.objects.bump(
+                Recipes._meta.label_lower,
+                RecipeIngredientsAmount._meta.label_lower
+            )
+
+    @staticmethod
+    def bulk_create_recipes(recipes):
+        """Один INSERT на пакет. Сигналы при этом не отправляются,
+            поэтому счётчики рецептов, ссылки на картинки, построение
+            вариантов картинок и поисковый индекс — здесь же, как
+            в recipe_image_changed для рецептов, сохранённых по одному"""
+
+        Recipes.objects.bulk_create(recipes)
+        for author_id, total in Counter(
+            recipe.author_id for recipe in recipes
+        ).items():
+            User.objects.filter(pk=author_id).update(
+                recipes_count=F('recipes_count') + total
+            )
+        for image, total in Counter(
+            recipe.image.name for recipe in recipes
+        ).items():
+            RecipeImage.objects.acquire(image, total)
+        for recipe in recipes:
+            schedule_recipe_image(recipe)
+        RecipeSearchTerm.objects.index(recipes)
@@ -1,37 +1,209 @@
 import csv
+import io
 
 from django.core.management.base import BaseCommand
-from recipes.models import Ingredient, Tag
+from django.db import connection, transaction
+from django.utils import timezone
+from recipes.models import DataVersion, Ingredient, Recipes, Tag
 
 PATH_INGREDIENT_CSV = '/app/data/ingredients.csv'
 PATH_TAGS_CSV = '/app/data/tags.csv'
+BATCH_SIZE = 1000
+INGREDIENT_HEADER = ['name', 'measurement_unit']
+TAG_HEADER = ['name', 'color', 'slug']
+
+
+def read_rows(path, header):
+    """Строки CSV с номерами: пустые строки и заголовок пропускаются"""
+
+    with open(path, 'r', encoding='utf-8-sig', newline='') as file:
+        for line_number, row in enumerate(csv.reader(file), start=1):
+            row = [value.strip() for value in row]
+            if not any(row) or row == header:
+
+                continue
+
+            yield line_number, row
+
+
+def batches(items, size):
+
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class CsvStream(io.TextIOBase):
+    """Файловый объект для COPY: строки CSV формируются по мере
+        чтения, и файл не собирается в памяти целиком"""
+
+    def __init__(self, rows):
+        self.rows = iter(rows)
+        self.line = io.StringIO()
+        self.writer = csv.writer(self.line)
+        self.pending = ''
+
+    def readable(self):
+
+        return True
+
+    def read(self, size=-1):
+
+        while size < 0 or len(self.pending) < size:
+            row = next(self.rows, None)
+            if row is None:
+                break
+            self.writer.writerow(row)
+            self.pending += self.line.getvalue()
+            self.line.seek(0)
+            self.line.truncate()
+        if size < 0:
+            size = len(self.pending)
+        try:
+            return self.pending[:size]
+        finally:
+            self.pending = self.pending[size:]
+
+
+def copy_ingredients(rows):
+    """PostgreSQL: один COPY всех строк во временную таблицу и один
+        INSERT с пропуском уже существующих пар"""
+
+    table = connection.ops.quote_name(Ingredient._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'CREATE TEMPORARY TABLE ingredient_load '
+            '(name text, measurement_unit text) ON COMMIT DROP'
+        )
+        cursor.copy_expert(
+            'COPY ingredient_load FROM STDIN WITH (FORMAT csv)',
+            CsvStream(rows)
+        )
+        cursor.execute(
+            f'INSERT INTO {table} (name, measurement_unit) '
+            'SELECT name, measurement_unit FROM ingredient_load '
+            'ON CONFLICT DO NOTHING'
+        )
+
+        return cursor.rowcount
 
 
 class Command(BaseCommand):
-    help = 'Загрузка csv в ДТ'
+    help = (
+        'Загрузка csv в ДТ: новые ингредиенты и теги добавляются, '
+        'изменённые теги обновляются, повторная загрузка ничего не меняет'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--ingredients',
+            default=PATH_INGREDIENT_CSV,
+            help='CSV с колонками name, measurement_unit',
+        )
+        parser.add_argument(
+            '--tags',
+            default=PATH_TAGS_CSV,
+            help='CSV с колонками name, color, slug',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=BATCH_SIZE,
+        )
 
     def handle(self, *args, **options):
 
-        with open(PATH_INGREDIENT_CSV, 'r', encoding='utf-8') as file:
-            reader = csv.reader(file)
-            next(reader)
-            for name, measurement_unit in reader:
-                Ingredient.objects.get_or_create(
-                    name=name,
-                    measurement_unit=measurement_unit
-                )
+        self.batch_size = options['batch_size']
+        created = self.load_ingredients(options['ingredients'])
+        self.stdout.write(
+            f'Данные из списка ингредиентов загружены: новых {created}'
+        )
+        created, updated = self.load_tags(options['tags'])
         self.stdout.write(
-            'Данные из списка ингредиентов загружены '
-            + str(Ingredient.objects.all().count())
-        )
-
-        with open(PATH_TAGS_CSV, 'r', encoding='utf-8') as file:
-            reader = csv.reader(file)
-            next(reader)
-            for name, color, slug in reader:
-                Tag.objects.get_or_create(
-                    name=name,
-                    color=color,
-                    slug=slug
+            f'Данные из списка тегов загружены: новых {created}, '
+            f'изменённых {updated}'
+        )
+
+    def report_error(self, path, line_number, row):
+
+        self.stderr.write(f'{path}, строка {line_number}: пропущена {row}')
+
+    def new_ingredients(self, path):
+        """Пары (название, единица), которых ещё нет в базе"""
+
+        existing = set(
+            Ingredient.objects.values_list('name', 'measurement_unit')
+        )
+        for line_number, row in read_rows(path, INGREDIENT_HEADER):
+            if len(row) != 2 or not all(row):
+                self.report_error(path, line_number, row)
+
+                continue
+
+            key = tuple(row)
+            if key not in existing:
+                existing.add(key)
+                yield key
+
+    def load_ingredients(self, path):
+
+        with transaction.atomic():
+            if connection.vendor == 'postgresql':
+                created = copy_ingredients(self.new_ingredients(path))
+            else:
+                before = Ingredient.objects.count()
+                for batch in batches(
+                    self.new_ingredients(path), self.batch_size
+                ):
+                    Ingredient.objects.bulk_create(
+                        (
+                            Ingredient(name=name, measurement_unit=unit)
+                            for name, unit in batch
+                        ),
+                        ignore_conflicts=True
+                    )
+                created = Ingredient.objects.count() - before
+            if created:
+                DataVersion.objects.bump(Ingredient._meta.label_lower)
+
+        return created
+
+    def load_tags(self, path):
+
+        existing = Tag.objects.in_bulk(field_name='slug')
+        new, changed = {}, []
+        for line_number, row in read_rows(path, TAG_HEADER):
+            if len(row) != 3 or not all(row):
+                self.report_error(path, line_number, row)
+
+                continue
+
+            name, color, slug = row
+            tag = existing.get(slug)
+            if tag is None:
+                new[slug] = Tag(name=name, slug=slug, color=color)
+            elif (tag.name, tag.color) != (name, color):
+                tag.name, tag.color = name, color
+                changed.append(tag)
+
+        with transaction.atomic():
+            Tag.objects.bulk_create(
+                new.values(), batch_size=self.batch_size,
+                ignore_conflicts=True
+            )
+            Tag.objects.bulk_update(
+                changed, ['name', 'color'], batch_size=self.batch_size
+            )
+            if changed:
+                Recipes.objects.filter(tags__in=changed).update(
+                    modified=timezone.now()
                 )
-        self.stdout.write('Данные из списка тегов загружены')
+            if new or changed:
+                DataVersion.objects.bump(Tag._meta.label_lower)
+
+        return len(new), len(changed)
@@ -0,0 +1,96 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import (Count, F, IntegerField, OuterRef, Q, Subquery,
+                              Sum, Value)
+from django.db.models.functions import Coalesce
+from recipes.models import (Favourites, RecipeIngredientsAmount, Recipes,
+                            ShoppingCartIngredient)
+from users.models import Subscription, User
+
+
+def count_subquery(model, field):
+    """Количество строк model, ссылающихся на объект через field"""
+
+    return Coalesce(
+        Subquery(
+            model.objects
+            .filter(**{field: OuterRef('pk')})
+            .order_by()
+            .values(field)
+            .annotate(total=Count('pk'))
+            .values('total'),
+            output_field=IntegerField()
+        ),
+        Value(0)
+    )
+
+
+COUNTERS = (
+    (Recipes, 'favourites_count', Favourites, 'recipe'),
+    (User, 'recipes_count', Recipes, 'author'),
+    (User, 'subscribers_count', Subscription, 'author'),
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Проверка и пересчёт счётчиков избранного, рецептов, подписчиков '
+        'и сводных списков покупок'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help='Только показать расхождения, ничего не изменяя',
+        )
+
+    def handle(self, *args, **options):
+
+        for model, field, related_model, related_field in COUNTERS:
+            actual = count_subquery(related_model, related_field)
+            drifted = (
+                model.objects
+                .annotate(actual=actual)
+                .filter(~Q(**{field: F('actual')}))
+                .count()
+            )
+            label = f'{model._meta.verbose_name_plural}.{field}'
+
+            if options['check'] or not drifted:
+                self.stdout.write(f'{label}: расхождений {drifted}')
+
+                continue
+
+            with transaction.atomic():
+                model.objects.update(**{field: actual})
+            self.stdout.write(
+                self.style.SUCCESS(f'{label}: исправлено {drifted}')
+            )
+
+        expected = set(
+            RecipeIngredientsAmount.objects
+            .filter(recipes__shopping_list__isnull=False)
+            .order_by()
+            .values('recipes__shopping_list__user', 'ingredient')
+            .annotate(total_amount=Sum('amount'))
+            .values_list(
+                'recipes__shopping_list__user', 'ingredient', 'total_amount'
+            )
+        )
+        stored = set(
+            ShoppingCartIngredient.objects
+            .values_list('user_id', 'ingredient_id', 'amount')
+        )
+        user_ids = {user_id for user_id, _, _ in expected ^ stored}
+        label = ShoppingCartIngredient._meta.verbose_name_plural
+
+        if options['check'] or not user_ids:
+            self.stdout.write(f'{label}: расхождений {len(user_ids)}')
+
+            return
+
+        ShoppingCartIngredient.objects.rebuild(user_ids)
+        self.stdout.write(
+            self.style.SUCCESS(f'{label}: исправлено {len(user_ids)}')
+        )
@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from recipes.images import build_variants
+from recipes.models import Recipes
+
+CHUNK_SIZE = 100
+
+
+class Command(BaseCommand):
+    help = 'Построение уменьшенных копий и заглушек картинок рецептов'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            help='Перестроить и уже готовые варианты',
+        )
+
+    def handle(self, *args, **options):
+
+        recipes = Recipes.objects.exclude(image='').order_by('pk')
+        if not options['all']:
+            recipes = recipes.filter(images={})
+
+        built = failed = 0
+        for pk, name in recipes.values_list('pk', 'image').iterator(
+            chunk_size=CHUNK_SIZE
+        ):
+            try:
+                variants = build_variants(name)
+            except Exception as error:
+                failed += 1
+                self.stderr.write(f'{name}: {error}')
+
+                continue
+
+            built += Recipes.objects.filter(pk=pk, image=name).update(
+                images=variants, modified=timezone.now()
+            )
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Обработано картинок: {built}, ошибок: {failed}'
+        ))
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from recipes.models import Recipes, RecipeSearchTerm
+
+BATCH_SIZE = 500
+
+
+class Command(BaseCommand):
+    help = 'Перестроение поискового индекса рецептов'
+
+    def handle(self, *args, **options):
+
+        batch = []
+        total = 0
+        for recipe in (
+            Recipes.objects
+            .order_by('pk')
+            .only('pk', 'name', 'text')
+            .iterator(chunk_size=BATCH_SIZE)
+        ):
+            batch.append(recipe)
+            if len(batch) == BATCH_SIZE:
+                total += self.index(batch)
+                batch = []
+        total += self.index(batch)
+
+        self.stdout.write(
+            self.style.SUCCESS(f'Проиндексировано рецептов: {total}')
+        )
+
+    @staticmethod
+    def index(recipes):
+
+        with transaction.atomic():
+            RecipeSearchTerm.objects.index(recipes)
+
+        return len(recipes)
@@ -0,0 +1,49 @@
+# Generated by Django 3.2.18 on 2026-10-18 17:50
+
+import recipes.storage
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def fill_references(apps, schema_editor):
+    Recipes = apps.get_model('recipes', 'Recipes')
+    RecipeImage = apps.get_model('recipes', 'RecipeImage')
+
+    RecipeImage.objects.bulk_create(
+        RecipeImage(name=image, references=references)
+        for image, references in (
+            Recipes.objects
+            .exclude(image='')
+            .order_by()
+            .values('image')
+            .annotate(references=Count('pk'))
+            .values_list('image', 'references')
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0020_recipes_images'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecipeImage',
+            fields=[
+                ('name', models.CharField(max_length=255, primary_key=True, serialize=False, verbose_name='Файл')),
+                ('references', models.PositiveIntegerField(default=0, verbose_name='Ссылок')),
+            ],
+            options={
+                'verbose_name': 'Картинка рецепта',
+                'verbose_name_plural': 'Картинки рецептов',
+            },
+        ),
+        migrations.AlterField(
+            model_name='recipes',
+            name='image',
+            field=models.ImageField(storage=recipes.storage.ContentAddressedStorage(), upload_to='recipes/', verbose_name='Картинка'),
+        ),
+        migrations.RunPython(fill_references, migrations.RunPython.noop),
+    ]
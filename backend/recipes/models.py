@@ -1,13 +1,42 @@
+import contextvars
+from contextlib import contextmanager
+
 from django.core.validators import MinValueValidator
-from django.db import models
+from django.db import IntegrityError, connections, models, transaction
+from django.db.models import (Count, Exists, F, OuterRef, Prefetch, Subquery,
+                              Sum, Value, Window)
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import RowNumber
+from django.utils import timezone
 from foodgram.constants import (MINIMUM_COOCING_TIME_IN_MINUTES,
                                 MINIMUM_RECIPE_INGREDIENTS_AMOUNT)
-from users.models import User
+from users.models import Subscription, User
+
+from .stemmer import MAXIMUM_TERM_LENGTH, search_terms
+from .storage import ContentAddressedStorage
 
 ORANGE = '#E26C2D'
 GREEN = '#49B64E'
 PURPLE = '#8775D2'
 
+RECIPE_NAME_SEARCH_WEIGHT = 3
+
+recipe_batch = contextvars.ContextVar('recipe_batch', default=False)
+
+
+@contextmanager
+def recipe_relations_batch():
+    """Пакетное изменение связей рецептов: удаление рецептов каскадом
+        или правка ингредиентов сериализатором. Версии данных и дату
+        изменения рецепта вызывающий код обновляет один раз, поэтому
+        обработчики сигналов отдельных строк связей их пропускают"""
+
+    token = recipe_batch.set(True)
+    try:
+        yield
+    finally:
+        recipe_batch.reset(token)
+
 
 class Tag(models.Model):
     """Описание модели Тег"""
@@ -73,6 +102,144 @@ class Ingredient(models.Model):
         return f'{self.name}, {self.measurement_unit}'
 
 
+def recipe_relations():
+    """Связи, которые нужны для представления рецепта"""
+
+    return (
+        'tags',
+        Prefetch(
+            'recipeingredientsamount_set',
+            queryset=RecipeIngredientsAmount.objects.select_related(
+                'ingredient'
+            )
+        ),
+    )
+
+
+def set_prefetched(instance, name, objects):
+    """Подставляет уже загруженные объекты связи name в кэш
+        prefetch_related, чтобы их не запрашивать повторно"""
+
+    queryset = getattr(instance, name).all()
+    queryset._result_cache = list(objects)
+    queryset._prefetch_done = True
+    if not hasattr(instance, '_prefetched_objects_cache'):
+        instance._prefetched_objects_cache = {}
+    instance._prefetched_objects_cache[name] = queryset
+
+
+class RecipesQuerySet(models.QuerySet):
+    """Запросы к модели Рецепты"""
+
+    def delete(self):
+
+        with recipe_relations_batch():
+            return super().delete()
+
+    def latest_for_authors(self, author_ids, limit):
+        """Не более limit последних рецептов каждого автора одним
+            запросом: номер рецепта внутри автора считает ROW_NUMBER()
+            по разделу author в подзапросе, отбор по номеру — снаружи,
+            потому что фильтровать по оконной функции Django не умеет.
+            Без оконных функций — коррелированный подзапрос с LIMIT"""
+
+        connection = connections[self.db]
+        if not connection.features.supports_over_clause:
+
+            return self.latest_for_authors_fallback(author_ids, limit)
+
+        ranked = (
+            Recipes.objects
+            .filter(author__in=author_ids)
+            .annotate(author_position=Window(
+                RowNumber(),
+                partition_by=F('author'),
+                order_by=(F('pub_date').desc(), F('id').desc()),
+            ))
+            .order_by()
+            .values('pk', 'author_position')
+        )
+        sql, params = ranked.query.sql_with_params()
+        quote = connection.ops.quote_name
+
+        return self.filter(pk__in=RawSQL(
+            'SELECT {id} FROM ({sql}) ranked WHERE {position} <= %s'.format(
+                id=quote('id'), sql=sql, position=quote('author_position')
+            ),
+            (*params, limit)
+        )).order_by('-pub_date', '-id')
+
+    def latest_for_authors_fallback(self, author_ids, limit):
+
+        latest = (
+            Recipes.objects
+            .filter(author=OuterRef('author'))
+            .order_by('-pub_date', '-id')
+            .values('pk')[:limit]
+        )
+
+        return (
+            self.filter(author__in=author_ids, pk__in=Subquery(latest))
+            .order_by('-pub_date', '-id')
+        )
+
+    def search(self, query):
+        """Рецепты, в названии или описании которых встречаются все
+            слова запроса, по убыванию релевантности"""
+
+        terms = search_terms(query)
+        if not terms:
+
+            return self
+
+        matches = (
+            RecipeSearchTerm.objects
+            .filter(term__in=terms)
+            .order_by()
+            .values('recipe')
+            .annotate(rank=Sum('weight'), matched=Count('term'))
+            .filter(matched=len(terms))
+        )
+
+        return self.filter(
+            pk__in=matches.values('recipe')
+        ).annotate(
+            search_rank=Subquery(
+                matches.filter(recipe=OuterRef('pk')).values('rank')
+            )
+        ).order_by('-search_rank', '-pub_date', '-id')
+
+    def with_user_flags(self, user):
+        """Признаки избранного, списка покупок и подписки на автора
+            для пользователя user одним запросом через Exists()"""
+
+        if user.is_anonymous:
+
+            return self.annotate(
+                is_favorited=Value(False, output_field=models.BooleanField()),
+                is_in_shopping_cart=Value(
+                    False, output_field=models.BooleanField()
+                ),
+                author_is_subscribed=Value(
+                    False, output_field=models.BooleanField()
+                ),
+            )
+
+        return self.annotate(
+            is_favorited=Exists(
+                Favourites.objects.filter(user=user, recipe=OuterRef('pk'))
+            ),
+            is_in_shopping_cart=Exists(
+                ShoppingList.objects.filter(user=user, recipe=OuterRef('pk'))
+            ),
+            author_is_subscribed=Exists(
+                Subscription.objects.filter(
+                    user=user, author=OuterRef('author')
+                )
+            ),
+        )
+
+
 class Recipes(models.Model):
     """Модель Рецепты"""
 
@@ -91,11 +258,22 @@ class Recipes(models.Model):
     image = models.ImageField(
         verbose_name='Картинка',
         upload_to='recipes/',
+        storage=ContentAddressedStorage(),
+    )
+    images = models.JSONField(
+        verbose_name='Варианты картинки',
+        default=dict,
+        blank=True,
+        editable=False,
     )
     pub_date = models.DateTimeField(
         verbose_name='Дата публикации',
         auto_now_add=True,
     )
+    modified = models.DateTimeField(
+        verbose_name='Дата изменения',
+        auto_now=True,
+    )
     text = models.TextField(
         verbose_name='Описание',
         help_text='Текст рецепта',
@@ -109,6 +287,11 @@ class Recipes(models.Model):
         verbose_name='Тег',
         related_name='recipes',
     )
+    favourites_count = models.PositiveIntegerField(
+        verbose_name='В избранном',
+        default=0,
+        editable=False,
+    )
     cooking_time = models.PositiveSmallIntegerField(
         verbose_name='Время (мин.)',
         help_text='Время приготовления (в мин.)',
@@ -121,16 +304,57 @@ class Recipes(models.Model):
         ]
     )
 
+    objects = RecipesQuerySet.as_manager()
+
     class Meta:
 
         ordering = ('-pub_date',)
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
         default_related_name = 'recipes'
+        indexes = [
+            models.Index(
+                fields=['author', '-pub_date'],
+                name='recipes_author_pub_date_idx',
+            ),
+            models.Index(
+                fields=['-pub_date', '-id'],
+                name='recipes_pub_date_id_idx',
+            ),
+        ]
 
     def __str__(self):
         return self.name
 
+    def delete(self, *args, **kwargs):
+
+        with recipe_relations_batch():
+            return super().delete(*args, **kwargs)
+
+    def search_weights(self):
+        """Веса основ слов: слово из названия весит больше,
+            чем слово из описания"""
+
+        weights = search_terms(self.text)
+        for term, count in search_terms(self.name).items():
+            weights[term] += count * RECIPE_NAME_SEARCH_WEIGHT
+
+        return weights
+
+
+class RecipeIngredientsAmountQuerySet(models.QuerySet):
+    """Запросы к модели Количество ингридиентов"""
+
+    def amounts_by_ingredient(self):
+        """Словарь {id ингредиента: суммарное количество}"""
+
+        return dict(
+            self.order_by()
+            .values('ingredient')
+            .annotate(total_amount=Sum('amount'))
+            .values_list('ingredient', 'total_amount')
+        )
+
 
 class RecipeIngredientsAmount(models.Model):
     """Описание модели Количество ингридиентов"""
@@ -156,6 +380,8 @@ class RecipeIngredientsAmount(models.Model):
         ]
     )
 
+    objects = RecipeIngredientsAmountQuerySet.as_manager()
+
     class Meta:
 
         ordering = ['recipes']
@@ -166,6 +392,60 @@ class RecipeIngredientsAmount(models.Model):
         return f'{self.ingredient}, {self.amount}'
 
 
+class RecipeSearchTermQuerySet(models.QuerySet):
+    """Запросы к поисковому индексу рецептов"""
+
+    def index(self, recipes):
+        """Перестроение индекса для рецептов recipes"""
+
+        recipes = list(recipes)
+        self.filter(recipe__in=recipes).delete()
+        self.bulk_create(
+            self.model(recipe=recipe, term=term, weight=weight)
+            for recipe in recipes
+            for term, weight in recipe.search_weights().items()
+        )
+
+
+class RecipeSearchTerm(models.Model):
+    """Описание модели Поисковый индекс: основы слов рецепта
+        с весом вхождений"""
+
+    recipe = models.ForeignKey(
+        Recipes,
+        on_delete=models.CASCADE,
+        verbose_name='Рецепт',
+    )
+    term = models.CharField(
+        verbose_name='Основа слова',
+        max_length=MAXIMUM_TERM_LENGTH,
+    )
+    weight = models.PositiveIntegerField(
+        verbose_name='Вес',
+        default=1,
+    )
+
+    objects = RecipeSearchTermQuerySet.as_manager()
+
+    class Meta:
+
+        verbose_name = 'Поисковый индекс'
+        verbose_name_plural = 'Поисковый индекс'
+        default_related_name = 'search_terms'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['recipe', 'term'],
+                name='unique_recipe_search_term',
+            )
+        ]
+        indexes = [
+            models.Index(fields=['term'], name='recipe_search_term_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.term} -> {self.recipe}'
+
+
 class Favourites(models.Model):
     """Описание модели Избранное"""
 
@@ -224,3 +504,272 @@ class ShoppingList(models.Model):
 
     def __str__(self):
         return f'{self.user} -> {self.recipe}'
+
+
+class ShoppingCartIngredientQuerySet(models.QuerySet):
+    """Запросы к модели Сводный список покупок"""
+
+    def apply_changes(self, user_ids, changes):
+        """Прибавляет changes {id ингредиента: изменение количества}
+            к сводным спискам пользователей user_ids.
+            Вызывается внутри транзакции изменения списка покупок"""
+
+        changes = {
+            ingredient_id: delta
+            for ingredient_id, delta in changes.items() if delta
+        }
+        if not user_ids or not changes:
+
+            return
+
+        with transaction.atomic():
+            existing = {
+                (row.user_id, row.ingredient_id): row
+                for row in self.select_for_update().filter(
+                    user__in=user_ids,
+                    ingredient__in=changes
+                )
+            }
+            to_create, to_update, to_delete = [], [], []
+            for user_id in user_ids:
+                for ingredient_id, delta in changes.items():
+                    row = existing.get((user_id, ingredient_id))
+                    if row is None:
+                        if delta > 0:
+                            to_create.append(self.model(
+                                user_id=user_id,
+                                ingredient_id=ingredient_id,
+                                amount=delta
+                            ))
+                        continue
+                    row.amount += delta
+                    if row.amount > 0:
+                        to_update.append(row)
+                    else:
+                        to_delete.append(row.pk)
+            self.bulk_create(to_create)
+            self.bulk_update(to_update, ['amount'])
+            self.filter(pk__in=to_delete).delete()
+
+    def add_recipe(self, user_id, recipe_id):
+
+        self.apply_changes(
+            [user_id],
+            RecipeIngredientsAmount.objects.filter(
+                recipes=recipe_id
+            ).amounts_by_ingredient()
+        )
+
+    def remove_recipe(self, user_id, recipe_id):
+
+        self.apply_changes(
+            [user_id],
+            {
+                ingredient_id: -amount
+                for ingredient_id, amount in (
+                    RecipeIngredientsAmount.objects.filter(
+                        recipes=recipe_id
+                    ).amounts_by_ingredient().items()
+                )
+            }
+        )
+
+    def change_recipe(self, recipe, old_amounts, new_amounts):
+        """Переносит правку ингредиентов рецепта в сводные списки
+            всех пользователей, у которых рецепт в списке покупок"""
+
+        changes = {
+            ingredient_id: (
+                new_amounts.get(ingredient_id, 0)
+                - old_amounts.get(ingredient_id, 0)
+            )
+            for ingredient_id in old_amounts.keys() | new_amounts.keys()
+        }
+        if not any(changes.values()):
+
+            return
+
+        self.apply_changes(
+            list(
+                ShoppingList.objects
+                .filter(recipe=recipe)
+                .values_list('user_id', flat=True)
+            ),
+            changes
+        )
+
+    def rebuild(self, user_ids):
+        """Пересчёт сводных списков из списков покупок"""
+
+        with transaction.atomic():
+            self.filter(user__in=user_ids).delete()
+            self.bulk_create(
+                self.model(
+                    user_id=row['recipes__shopping_list__user'],
+                    ingredient_id=row['ingredient'],
+                    amount=row['total_amount']
+                )
+                for row in (
+                    RecipeIngredientsAmount.objects
+                    .filter(recipes__shopping_list__user__in=user_ids)
+                    .order_by()
+                    .values('recipes__shopping_list__user', 'ingredient')
+                    .annotate(total_amount=Sum('amount'))
+                )
+            )
+
+
+class ShoppingCartIngredient(models.Model):
+    """Описание модели Сводный список покупок:
+        суммы ингредиентов по рецептам из списка покупок пользователя"""
+
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        verbose_name='Пользователь',
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        verbose_name='Ингредиент',
+    )
+    amount = models.PositiveIntegerField(
+        verbose_name='Количество',
+        default=0,
+    )
+
+    objects = ShoppingCartIngredientQuerySet.as_manager()
+
+    class Meta:
+
+        verbose_name = 'Сводный список покупок'
+        verbose_name_plural = 'Сводные списки покупок'
+        default_related_name = 'shopping_cart_ingredients'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'ingredient'],
+                name='unique_shopping_cart_ingredient',
+            )
+        ]
+
+    def __str__(self):
+        return f'{self.user} -> {self.ingredient}, {self.amount}'
+
+
+class DataVersionQuerySet(models.QuerySet):
+    """Запросы к модели Версия данных"""
+
+    def bump(self, *names):
+        """Увеличивает версии names, отмечая время изменения"""
+
+        now = timezone.now()
+        for name in names:
+            if self.filter(name=name).update(
+                version=F('version') + 1, modified=now
+            ):
+                continue
+            try:
+                with transaction.atomic():
+                    self.create(name=name, version=1, modified=now)
+            except IntegrityError:
+                self.filter(name=name).update(
+                    version=F('version') + 1, modified=now
+                )
+
+    def get_many(self, names):
+        """Словарь {имя: (версия, время изменения)}"""
+
+        versions = {
+            name: (version, modified)
+            for name, version, modified in self.filter(
+                name__in=names
+            ).values_list('name', 'version', 'modified')
+        }
+
+        return {name: versions.get(name, (0, None)) for name in names}
+
+
+class DataVersion(models.Model):
+    """Описание модели Версия данных: счётчик изменений модели
+        для валидаторов условных GET-запросов"""
+
+    name = models.CharField(
+        verbose_name='Модель',
+        max_length=100,
+        primary_key=True,
+    )
+    version = models.PositiveBigIntegerField(
+        verbose_name='Версия',
+        default=0,
+    )
+    modified = models.DateTimeField(
+        verbose_name='Дата изменения',
+        default=timezone.now,
+    )
+
+    objects = DataVersionQuerySet.as_manager()
+
+    class Meta:
+
+        verbose_name = 'Версия данных'
+        verbose_name_plural = 'Версии данных'
+
+    def __str__(self):
+        return f'{self.name}: {self.version}'
+
+
+class RecipeImageQuerySet(models.QuerySet):
+    """Запросы к модели Картинка рецепта"""
+
+    def acquire(self, name, count=1):
+        """Ещё count рецептов ссылаются на картинку name"""
+
+        if self.filter(name=name).update(references=F('references') + count):
+
+            return
+
+        try:
+            with transaction.atomic():
+                self.create(name=name, references=count)
+        except IntegrityError:
+            self.filter(name=name).update(
+                references=F('references') + count
+            )
+
+    def release(self, name):
+        """Рецепт больше не ссылается на картинку name.
+            True — ссылок не осталось и файл можно удалить"""
+
+        deleted, _ = self.filter(name=name, references__lte=1).delete()
+        if deleted:
+
+            return True
+
+        self.filter(name=name).update(references=F('references') - 1)
+
+        return False
+
+
+class RecipeImage(models.Model):
+    """Описание модели Картинка рецепта: число рецептов, которые
+        ссылаются на файл с одинаковым содержимым"""
+
+    name = models.CharField(
+        verbose_name='Файл',
+        max_length=255,
+        primary_key=True,
+    )
+    references = models.PositiveIntegerField(
+        verbose_name='Ссылок',
+        default=0,
+    )
+
+    objects = RecipeImageQuerySet.as_manager()
+
+    class Meta:
+
+        verbose_name = 'Картинка рецепта'
+        verbose_name_plural = 'Картинки рецептов'
+
+    def __str__(self):
+        return f'{self.name}: {self.references}'
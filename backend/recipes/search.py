@@ -0,0 +1,278 @@
+import heapq
+import logging
+import math
+import re
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from collections import Counter, namedtuple
+
+from django.db import close_old_connections
+from django.db.models import Count
+
+from .models import DataVersion, Ingredient, RecipeIngredientsAmount
+
+logger = logging.getLogger(__name__)
+
+WORD_RE = re.compile(r'\w+')
+
+TRIGRAM_SIMILARITY_THRESHOLD = 0.3
+MINIMUM_FUZZY_QUERY_LENGTH = 3
+COMMON_TRIGRAM_SHARE = 0.02
+MINIMUM_POSTINGS_LISTS = 2
+TRIGRAM_CANDIDATES_LIMIT = 300
+PREFIX_CANDIDATES_LIMIT = 200
+PREFIX_WEIGHT = 1.0
+WORD_PREFIX_WEIGHT = 0.5
+USAGE_WEIGHT = 0.3
+VERSION_CHECK_INTERVAL = 5
+
+IndexSnapshot = namedtuple(
+    'IndexSnapshot',
+    ('keys', 'rows', 'usage', 'postings', 'max_usage')
+)
+
+
+def normalize(value):
+    """Ключ поиска: casefold() корректно приводит кириллицу к нижнему
+        регистру, «ё» приравнивается к «е»"""
+
+    return value.casefold().replace('ё', 'е')
+
+
+def trigrams(value):
+    """Триграммы слов как в pg_trgm: два пробела в начале слова
+        и один в конце"""
+
+    result = set()
+    for word in WORD_RE.findall(value):
+        padded = f'  {word} '
+        result.update(
+            padded[position:position + 3]
+            for position in range(len(padded) - 2)
+        )
+
+    return result
+
+
+class IngredientIndex:
+    """Индекс ингредиентов в памяти процесса для автодополнения:
+        отсортированный массив нормализованных названий и bisect,
+        а для поиска с опечатками — инвертированный индекс триграмм.
+        Индекс перестраивается по версии данных ингредиентов в базе,
+        поэтому изменение ингредиентов видят все процессы. Если
+        изменились только ингредиенты рецептов, пересчитывается лишь
+        популярность. Версии проверяются не чаще раза
+        в VERSION_CHECK_INTERVAL секунд, устаревший индекс
+        перестраивается в фоновом потоке, а запросы тем временем
+        обслуживает прежний"""
+
+    version_names = (
+        Ingredient._meta.label_lower,
+        RecipeIngredientsAmount._meta.label_lower
+    )
+    thread_name = 'ingredient-index'
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._checked = None
+        self._rebuilding = False
+        self._index = None
+
+    def search(self, prefix, limit):
+        """Не более limit ингредиентов, название которых
+            начинается с prefix, в алфавитном порядке"""
+
+        index = self._refresh()
+        prefix = normalize(prefix)
+
+        return [
+            self._row(index, position)
+            for position in self._prefix_range(index, prefix, limit)
+        ]
+
+    def ranked_search(self, query, limit):
+        """Не более limit ингредиентов по убыванию релевантности:
+            совпадение начала названия или слова, сходство триграмм
+            и частота использования ингредиента в рецептах"""
+
+        index = self._refresh()
+        query = normalize(query)
+        query_trigrams = trigrams(query)
+        if not query_trigrams:
+
+            return []
+
+        candidates = set(
+            self._prefix_range(index, query, PREFIX_CANDIDATES_LIMIT)
+        )
+        if len(query) >= MINIMUM_FUZZY_QUERY_LENGTH:
+            candidates.update(
+                position for position, _ in self._trigram_candidates(
+                    index, query_trigrams
+                ).most_common(TRIGRAM_CANDIDATES_LIMIT)
+            )
+        usage_norm = math.log1p(index.max_usage) or 1
+
+        def score(position):
+            key = index.keys[position]
+            key_trigrams = trigrams(key)
+            similarity = len(query_trigrams & key_trigrams) / len(
+                query_trigrams | key_trigrams
+            )
+            if key.startswith(query):
+                similarity += PREFIX_WEIGHT
+            elif f' {query}' in key:
+                similarity += WORD_PREFIX_WEIGHT
+            elif similarity < TRIGRAM_SIMILARITY_THRESHOLD:
+
+                return None
+
+            return similarity + USAGE_WEIGHT * (
+                math.log1p(index.usage[position]) / usage_norm
+            )
+
+        scored = (
+            (value, position)
+            for value, position in (
+                (score(position), position) for position in candidates
+            )
+            if value is not None
+        )
+
+        return [
+            self._row(index, position)
+            for _, position in heapq.nlargest(
+                limit, scored, key=lambda item: (item[0], -item[1])
+            )
+        ]
+
+    @staticmethod
+    def _trigram_candidates(index, query_trigrams):
+        """Число общих триграмм по спискам вхождений. Самые частые
+            триграммы пропускаются, если хватает более редких: они почти
+            не влияют на отбор, а точное сходство считается позже"""
+
+        postings = sorted(
+            (
+                index.postings[trigram]
+                for trigram in query_trigrams if trigram in index.postings
+            ),
+            key=len
+        )
+        common_length = COMMON_TRIGRAM_SHARE * len(index.keys)
+        selected = [
+            positions for positions in postings
+            if len(positions) <= common_length
+        ] or postings[:MINIMUM_POSTINGS_LISTS]
+        shared = Counter()
+        for positions in selected:
+            shared.update(positions)
+
+        return shared
+
+    @staticmethod
+    def _prefix_range(index, prefix, limit):
+
+        keys = index.keys
+        start = bisect_left(keys, prefix)
+        stop = min(start + limit, len(keys))
+        for position in range(start, stop):
+            if not keys[position].startswith(prefix):
+                break
+            yield position
+
+    @staticmethod
+    def _row(index, position):
+
+        pk, name, measurement_unit = index.rows[position]
+
+        return {'id': pk, 'name': name, 'measurement_unit': measurement_unit}
+
+    def _refresh(self):
+        """Текущий снимок индекса. Строится в запросе только первый
+            раз, пока снимка ещё нет"""
+
+        now = time.monotonic()
+        if self._index is not None and (
+            now - self._checked < VERSION_CHECK_INTERVAL
+        ):
+
+            return self._index
+
+        found = DataVersion.objects.get_many(self.version_names)
+        version = tuple(found[name] for name in self.version_names)
+        with self._lock:
+            self._checked = now
+            if self._index is None:
+                self._build(version)
+            elif version != self._version and not self._rebuilding:
+                self._rebuilding = True
+                threading.Thread(
+                    target=self._rebuild,
+                    args=(version,),
+                    name=self.thread_name,
+                    daemon=True
+                ).start()
+
+        return self._index
+
+    def _rebuild(self, version):
+
+        try:
+            self._build(version)
+        except Exception:
+            logger.exception('Не удалось перестроить индекс ингредиентов')
+        finally:
+            self._rebuilding = False
+            close_old_connections()
+
+    def _build(self, version):
+
+        usage_by_id = dict(
+            RecipeIngredientsAmount.objects
+            .order_by()
+            .values('ingredient')
+            .annotate(total=Count('pk'))
+            .values_list('ingredient', 'total')
+        )
+        index = self._index
+        if index is not None and version[0] == self._version[0]:
+            usage = array(
+                'I', (usage_by_id.get(row[0], 0) for row in index.rows)
+            )
+            self._index = index._replace(
+                usage=usage, max_usage=max(usage, default=0)
+            )
+            self._version = version
+
+            return
+
+        entries = sorted(
+            (normalize(name), name, pk, measurement_unit)
+            for pk, name, measurement_unit in (
+                Ingredient.objects
+                .order_by()
+                .values_list('id', 'name', 'measurement_unit')
+                .iterator()
+            )
+        )
+        keys, rows = [], []
+        usage = array('I')
+        postings = {}
+        for position, (key, name, pk, measurement_unit) in enumerate(entries):
+            keys.append(key)
+            rows.append((pk, name, measurement_unit))
+            usage.append(usage_by_id.get(pk, 0))
+            for trigram in trigrams(key):
+                postings.setdefault(trigram, array('I')).append(position)
+
+        self._index = IndexSnapshot(
+            keys, rows, usage, postings, max(usage, default=0)
+        )
+        self._version = version
+
+
+ingredient_index = IngredientIndex()
@@ -0,0 +1,291 @@
+from django.db.models import F
+from django.db.models.signals import (m2m_changed, post_delete, post_save,
+                                      pre_delete, pre_save)
+from django.dispatch import receiver
+from django.utils import timezone
+from users.models import Subscription, User
+
+from .images import release_recipe_image, schedule_recipe_image
+from .models import (DataVersion, Favourites, Ingredient, RecipeImage,
+                     RecipeIngredientsAmount, Recipes, RecipeSearchTerm,
+                     ShoppingCartIngredient, ShoppingList, Tag, recipe_batch)
+
+
+def increment_recipes_count(author_id):
+
+    User.objects.filter(pk=author_id).update(
+        recipes_count=F('recipes_count') + 1
+    )
+
+
+def decrement_recipes_count(author_id):
+
+    User.objects.filter(pk=author_id, recipes_count__gt=0).update(
+        recipes_count=F('recipes_count') - 1
+    )
+
+
+@receiver(pre_save, sender=Recipes)
+def remember_recipe_author(sender, instance, raw, **kwargs):
+    """Запоминаем прежних автора и картинку, чтобы перенести
+        счётчик рецептов и сбросить устаревшие варианты картинки"""
+
+    if raw or instance._state.adding:
+        instance._previous_author_id = None
+        instance._previous_image = None
+        instance._previous_images = {}
+
+        return
+
+    (
+        instance._previous_author_id,
+        instance._previous_image,
+        instance._previous_images,
+    ) = (
+        Recipes.objects
+        .filter(pk=instance.pk)
+        .values_list('author_id', 'image', 'images')
+        .first()
+    ) or (None, None, {})
+    if instance._previous_image != instance.image.name:
+        instance.images = {}
+
+
+@receiver(post_save, sender=Recipes)
+def recipe_saved(sender, instance, created, raw, **kwargs):
+    """Счётчик рецептов автора"""
+
+    if raw:
+
+        return
+
+    if created:
+        increment_recipes_count(instance.author_id)
+
+        return
+
+    previous_author_id = getattr(instance, '_previous_author_id', None)
+    if previous_author_id != instance.author_id:
+        decrement_recipes_count(previous_author_id)
+        increment_recipes_count(instance.author_id)
+
+
+@receiver(post_save, sender=Recipes)
+def index_recipe(sender, instance, raw, update_fields, **kwargs):
+    """Поисковый индекс по названию и описанию рецепта"""
+
+    if raw or (
+        update_fields is not None
+        and not {'name', 'text'} & set(update_fields)
+    ):
+
+        return
+
+    RecipeSearchTerm.objects.index([instance])
+
+
+@receiver(post_save, sender=Recipes)
+def recipe_image_changed(sender, instance, created, raw, update_fields,
+                         **kwargs):
+    """Ссылки на файлы картинок; варианты новой картинки
+        строятся вне запроса"""
+
+    if raw or (update_fields is not None and 'image' not in update_fields):
+
+        return
+
+    previous = None if created else instance._previous_image
+    if previous == instance.image.name:
+
+        return
+
+    if instance.image:
+        RecipeImage.objects.acquire(instance.image.name)
+        schedule_recipe_image(instance)
+    if previous:
+        release_recipe_image(previous, instance._previous_images)
+
+
+@receiver(post_delete, sender=Recipes)
+def recipe_deleted(sender, instance, **kwargs):
+
+    decrement_recipes_count(instance.author_id)
+    if instance.image:
+        release_recipe_image(instance.image.name, instance.images)
+
+
+@receiver(pre_delete, sender=Recipes)
+def remove_recipe_from_shopping_carts(sender, instance, **kwargs):
+    """Вычитаем ингредиенты удаляемого рецепта из сводных списков,
+        пока количества ещё не удалены каскадом"""
+
+    ShoppingCartIngredient.objects.change_recipe(
+        instance,
+        RecipeIngredientsAmount.objects.filter(
+            recipes=instance
+        ).amounts_by_ingredient(),
+        {}
+    )
+
+
+@receiver(post_save, sender=Favourites)
+def favourite_created(sender, instance, created, raw, **kwargs):
+    """Счётчик добавлений рецепта в избранное"""
+
+    if created and not raw:
+        Recipes.objects.filter(pk=instance.recipe_id).update(
+            favourites_count=F('favourites_count') + 1
+        )
+
+
+@receiver(post_delete, sender=Favourites)
+def favourite_deleted(sender, instance, **kwargs):
+
+    if recipe_batch.get():
+
+        return
+
+    Recipes.objects.filter(
+        pk=instance.recipe_id,
+        favourites_count__gt=0
+    ).update(favourites_count=F('favourites_count') - 1)
+
+
+@receiver(post_save, sender=ShoppingList)
+def shopping_list_added(sender, instance, created, raw, **kwargs):
+    """Ингредиенты рецепта прибавляются к сводному списку покупок"""
+
+    if created and not raw:
+        ShoppingCartIngredient.objects.add_recipe(
+            instance.user_id, instance.recipe_id
+        )
+
+
+@receiver(post_delete, sender=ShoppingList)
+def shopping_list_removed(sender, instance, **kwargs):
+    """При удалении рецепта сводные списки уже исправлены
+        в remove_recipe_from_shopping_carts"""
+
+    if recipe_batch.get():
+
+        return
+
+    ShoppingCartIngredient.objects.remove_recipe(
+        instance.user_id, instance.recipe_id
+    )
+
+
+VERSIONED_MODELS = (
+    Tag, Ingredient, Recipes, RecipeIngredientsAmount,
+    Favourites, ShoppingList, Subscription, User,
+)
+USER_PUBLIC_FIELDS = {'email', 'username', 'first_name', 'last_name'}
+RECIPE_RELATIONS = (RecipeIngredientsAmount, Favourites, ShoppingList)
+
+
+def version_name(model):
+
+    return model._meta.label_lower
+
+
+def touch_recipes(recipes):
+    """Обновляет дату изменения рецептов, представление которых
+        зависит от изменившихся связанных данных"""
+
+    recipes.update(modified=timezone.now())
+
+
+def bump_version(sender, **kwargs):
+
+    if sender in RECIPE_RELATIONS and recipe_batch.get():
+
+        return
+
+    DataVersion.objects.bump(version_name(sender))
+
+
+for model in VERSIONED_MODELS:
+    if model is not User:
+        post_save.connect(bump_version, sender=model)
+    post_delete.connect(bump_version, sender=model)
+
+
+@receiver(post_delete, sender=Recipes)
+def recipe_relations_deleted(sender, **kwargs):
+    """Связи удалённого рецепта удаляются каскадом без обработки
+        отдельных строк, их версии повышаются один раз"""
+
+    DataVersion.objects.bump(*(
+        version_name(model) for model in RECIPE_RELATIONS
+    ))
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, created, update_fields, **kwargs):
+    """Изменение публичных полей автора меняет его рецепты"""
+
+    if update_fields is not None and not USER_PUBLIC_FIELDS & set(
+        update_fields
+    ):
+
+        return
+
+    DataVersion.objects.bump(version_name(User))
+    if not created:
+        touch_recipes(Recipes.objects.filter(author=instance))
+
+
+@receiver(pre_delete, sender=User)
+def user_deleted(sender, instance, **kwargs):
+    """Рецепты удаляемого автора остаются без автора: SET_NULL
+        выполняется через update() без сигналов, поэтому дата
+        изменения рецептов обновляется до удаления"""
+
+    touch_recipes(Recipes.objects.filter(author=instance))
+
+
+@receiver(post_save, sender=RecipeIngredientsAmount)
+@receiver(post_delete, sender=RecipeIngredientsAmount)
+def recipe_ingredients_changed(sender, instance, **kwargs):
+    """Правка отдельной строки, например во вставке админки;
+        пакетные изменения обновляют рецепт сами"""
+
+    if recipe_batch.get():
+
+        return
+
+    touch_recipes(Recipes.objects.filter(pk=instance.recipes_id))
+
+
+@receiver(m2m_changed, sender=Recipes.tags.through)
+def recipe_tags_changed(sender, instance, action, reverse, pk_set, **kwargs):
+
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+
+        return
+
+    DataVersion.objects.bump(version_name(Recipes))
+    if not reverse:
+        touch_recipes(Recipes.objects.filter(pk=instance.pk))
+    elif pk_set:
+        touch_recipes(Recipes.objects.filter(pk__in=pk_set))
+    else:
+        touch_recipes(Recipes.objects.filter(tags=instance))
+
+
+@receiver(post_save, sender=Tag)
+@receiver(pre_delete, sender=Tag)
+def tag_changed(sender, instance, **kwargs):
+
+    touch_recipes(Recipes.objects.filter(tags=instance))
+
+
+@receiver(post_save, sender=Ingredient)
+def ingredient_renamed(sender, instance, created, **kwargs):
+
+    if not created:
+        touch_recipes(
+            Recipes.objects.filter(
+                recipeingredientsamount__ingredient=instance
+            )
+        )
@@ -0,0 +1,90 @@
+import re
+from collections import Counter
+
+VOWELS = 'аеиоуыэюя'
+WORD_RE = re.compile(r'\w+')
+MINIMUM_WORD_LENGTH = 2
+MAXIMUM_TERM_LENGTH = 64
+STOP_WORDS = frozenset((
+    'без', 'бы', 'был', 'была', 'были', 'было', 'быть', 'во', 'вот', 'все',
+    'да', 'для', 'до', 'его', 'ее', 'если', 'же', 'за', 'из', 'или', 'им',
+    'их', 'как', 'ко', 'ли', 'мы', 'на', 'над', 'не', 'нет', 'но', 'об',
+    'он', 'она', 'они', 'от', 'по', 'под', 'при', 'про', 'со', 'так',
+    'там', 'то', 'уже', 'чем', 'что', 'это',
+))
+
+RV_RE = re.compile(rf'^(.*?[{VOWELS}])(.*)$')
+PERFECTIVE_GERUND_RE = re.compile(
+    r'((ив|ивши|ившись|ыв|ывши|ывшись)|((?<=[ая])(в|вши|вшись)))$'
+)
+REFLEXIVE_RE = re.compile(r'(с[яь])$')
+ADJECTIVE_RE = re.compile(
+    r'(ее|ие|ые|ое|ими|ыми|ей|ий|ый|ой|ем|им|ым|ом|его|ого|ему|ому|их|ых|'
+    r'ую|юю|ая|яя|ою|ею)$'
+)
+PARTICIPLE_RE = re.compile(r'((ивш|ывш|ующ)|((?<=[ая])(ем|нн|вш|ющ|щ)))$')
+VERB_RE = re.compile(
+    r'((ила|ыла|ена|ейте|уйте|ите|или|ыли|ей|уй|ил|ыл|им|ым|ен|ило|ыло|ено|'
+    r'ят|ует|уют|ит|ыт|ены|ить|ыть|ишь|ую|ю)|'
+    r'((?<=[ая])(ла|на|ете|йте|ли|й|л|ем|н|ло|но|ет|ют|ны|ть|ешь|нно)))$'
+)
+NOUN_RE = re.compile(
+    r'(а|ев|ов|ие|ье|е|иями|ями|ами|еи|ии|и|ией|ей|ой|ий|й|иям|ям|ием|ем|'
+    r'ам|ом|о|у|ах|иях|ях|ы|ь|ию|ью|ю|ия|ья|я)$'
+)
+I_RE = re.compile(r'и$')
+DERIVATIONAL_R2_RE = re.compile(rf'.*[^{VOWELS}]+[{VOWELS}].*ость?$')
+DERIVATIONAL_RE = re.compile(r'ость?$')
+SOFT_SIGN_RE = re.compile(r'ь$')
+SUPERLATIVE_RE = re.compile(r'(ейше|ейш)$')
+DOUBLE_N_RE = re.compile(r'нн$')
+
+
+def stem(word):
+    """Основа русского слова по алгоритму Портера (Snowball)"""
+
+    word = word.casefold().replace('ё', 'е')
+    match = RV_RE.match(word)
+    if match is None:
+
+        return word
+
+    start, rv = match.groups()
+    if not rv:
+
+        return word
+
+    stripped = PERFECTIVE_GERUND_RE.sub('', rv, 1)
+    if stripped == rv:
+        rv = REFLEXIVE_RE.sub('', rv, 1)
+        stripped = ADJECTIVE_RE.sub('', rv, 1)
+        if stripped != rv:
+            rv = PARTICIPLE_RE.sub('', stripped, 1)
+        else:
+            stripped = VERB_RE.sub('', rv, 1)
+            rv = NOUN_RE.sub('', rv, 1) if stripped == rv else stripped
+    else:
+        rv = stripped
+
+    rv = I_RE.sub('', rv, 1)
+    if DERIVATIONAL_R2_RE.match(rv):
+        rv = DERIVATIONAL_RE.sub('', rv, 1)
+
+    stripped = SOFT_SIGN_RE.sub('', rv, 1)
+    if stripped == rv:
+        rv = SUPERLATIVE_RE.sub('', rv, 1)
+        rv = DOUBLE_N_RE.sub('н', rv, 1)
+    else:
+        rv = stripped
+
+    return start + rv
+
+
+def search_terms(text):
+    """Основы слов текста с числом вхождений, без стоп-слов"""
+
+    return Counter(
+        stem(word)[:MAXIMUM_TERM_LENGTH]
+        for word in WORD_RE.findall(text.casefold().replace('ё', 'е'))
+        if len(word) >= MINIMUM_WORD_LENGTH and word not in STOP_WORDS
+    )
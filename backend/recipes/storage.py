@@ -0,0 +1,45 @@
+import hashlib
+import os
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+
+HASH_CHUNK_SIZE = 64 * 1024
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """Файлы называются по SHA-256 содержимого: одинаковые картинки
+        хранятся один раз, а содержимое файла по ссылке никогда
+        не меняется, поэтому его можно кэшировать бессрочно.
+        Повторно загруженный файл «трогается», чтобы сборщик
+        осиротевших файлов не удалил его в течение срока ожидания"""
+
+    def save(self, name, content, max_length=None):
+
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+
+        name = self.hashed_name(name, content)
+        if self.exists(name):
+            os.utime(self.path(name))
+
+            return name
+
+        return super().save(name, content, max_length)
+
+    @staticmethod
+    def hashed_name(name, content):
+        """recipes/ab/ab12…ef.jpeg для recipes/temp.jpeg"""
+
+        digest = hashlib.sha256()
+        content.seek(0)
+        for chunk in content.chunks(HASH_CHUNK_SIZE):
+            digest.update(chunk)
+        content.seek(0)
+        directory, filename = os.path.split(name)
+        extension = os.path.splitext(filename)[1].lower()
+        digest = digest.hexdigest()
+
+        return os.path.join(directory, digest[:2], digest + extension)
@@ -13,21 +13,13 @@ class UserAdmin(admin.ModelAdmin):
         'email',
         'first_name',
         'last_name',
-        'count_recipes',
-        'count_subscribers'
+        'recipes_count',
+        'subscribers_count'
     )
     list_filter = ('email', 'username',)
     search_fields = ('email', 'username',)
     list_editable = ('username', 'email', 'first_name', 'last_name')
 
-    def count_subscribers(self, obj):
-        return obj.blogger.count()
-    count_subscribers.short_description = 'Подписчиков'
-
-    def count_recipes(self, obj):
-        return obj.recipes.count()
-    count_recipes.short_description = 'Рецептов'
-
 
 @admin.register(Subscription)
 class SubscriptionAdmin(admin.ModelAdmin):
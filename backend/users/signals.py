@@ -0,0 +1,25 @@
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Subscription, User
+
+
+@receiver(post_save, sender=Subscription)
+def subscription_created(sender, instance, created, raw, **kwargs):
+    """Увеличение счётчика подписчиков автора"""
+
+    if created and not raw:
+        User.objects.filter(pk=instance.author_id).update(
+            subscribers_count=F('subscribers_count') + 1
+        )
+
+
+@receiver(post_delete, sender=Subscription)
+def subscription_deleted(sender, instance, **kwargs):
+    """Уменьшение счётчика подписчиков автора"""
+
+    User.objects.filter(
+        pk=instance.author_id,
+        subscribers_count__gt=0
+    ).update(subscribers_count=F('subscribers_count') - 1)